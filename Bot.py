@@ -5,12 +5,74 @@ import traceback
 import math
 import time
 import datetime
+import os
+import struct
+import itertools
+import bisect
+import collections
+import mmap
+import threading
+import Queue
+import json
+import cProfile
+from array import array
+
+# When the module started loading, for the start up time in the log
+STARTED = time.time ()
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import multiprocessing
+except ImportError:
+    multiprocessing = None
 
 
 class Random(object):
     '''
     Random class
+
+    A seedable xorshift64* generator, so runs can be reproduced. The static
+    methods use the shared generator Random.generator; simulations that
+    need their own stream create their own Random.
     '''
+    MASK = 0xFFFFFFFFFFFFFFFF
+
+    def __init__ (self, seed = None):
+        self.setSeed (seed)
+
+    def setSeed (self, seed = None):
+        if seed == None:
+            seed = int (time.time () * 1000000) ^ (os.getpid () << 40)
+        # splitmix64, so that close seeds give unrelated streams
+        z = (seed + 0x9E3779B97F4A7C15) & Random.MASK
+        z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & Random.MASK
+        z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & Random.MASK
+        z ^= z >> 31
+        if z == 0:
+            z = 1
+        self._state = z
+
+    def next64 (self):
+        x = self._state
+        x ^= x >> 12
+        x ^= (x << 25) & Random.MASK
+        x ^= x >> 27
+        self._state = x
+        return (x * 0x2545F4914F6CDD1D) & Random.MASK
+
+    def below (self, n):
+        ''' Integer in [0, n) '''
+        return ((self.next64 () >> 11) * n) >> 53
+
+    @staticmethod
+    def seed (seed):
+        ''' Reseeds the shared generator '''
+        Random.generator.setSeed (seed)
+
     @staticmethod
     def randrange(min, max):
         '''
@@ -19,7 +81,7 @@ class Random(object):
         Works with an inclusive left bound and exclusive right bound.
         E.g. Random.randrange(0, 5) in [0, 1, 2, 3, 4] is always true
         '''
-        return min + int(math.fmod(pow(time.clock() + math.pi, 2), 1.0) * (max - min))
+        return min + Random.generator.below (max - min)
 
     @staticmethod
     def shuffle(items):
@@ -28,14 +90,204 @@ class Random(object):
         '''
         i = len(items)
         while i > 1:
-            i -= 1
             j = Random.randrange(0, i)
+            i -= 1
             items[j], items[i] = items[i], items[j]
         return items
 
+Random.generator = Random ()
+
+
+class Log (object):
+    """
+    Leveled logging with the formatting and the file writes done by a
+    background thread.
+
+    Log.debug (fmt, *args) and the others only compare the level while the
+    log is off (the default), so the messages cost nothing to build; once
+    Log.start is called they queue (time, level, fmt, args) and the writer
+    thread does fmt % args and writes to a buffered file, flushed when the
+    queue is drained or every FLUSH_INTERVAL seconds.  The arguments are
+    formatted later, so they must not be changed after the call.
+    """
+
+    DEBUG = 10
+    INFO = 20
+    WARNING = 30
+    ERROR = 40
+    OFF = 100
+    LEVELS = {'DEBUG': DEBUG, 'INFO': INFO, 'WARNING': WARNING,
+        'ERROR': ERROR, 'OFF': OFF}
+    NAMES = dict ((v, k) for k, v in LEVELS.items ())
+
+    FILE = "perro.txt"
+    FLUSH_INTERVAL = 1.0
+
+    level = OFF
+    queue = None
+    thread = None
+
+    @staticmethod
+    def start (path = None, level = DEBUG):
+        if Log.thread != None:
+            Log.stop ()
+        if path == None:
+            path = Log.FILE
+        Log.queue = Queue.Queue ()
+        Log.thread = threading.Thread (target = Log.writer,
+            args = (open (path, "a"), Log.queue))
+        Log.thread.daemon = True
+        Log.thread.start ()
+        Log.level = level
+
+    @staticmethod
+    def stop ():
+        """ Writes what is queued and stops the writer """
+        Log.level = Log.OFF
+        if Log.thread != None:
+            Log.queue.put (None)
+            Log.thread.join ()
+            Log.thread = None
+            Log.queue = None
+
+    @staticmethod
+    def writer (fp, queue):
+        while True:
+            try:
+                item = queue.get (timeout = Log.FLUSH_INTERVAL)
+            except Queue.Empty:
+                fp.flush ()
+                continue
+            if item == None:
+                break
+            t, level, fmt, args = item
+            try:
+                msg = fmt % args
+            except Exception, e:
+                msg = fmt + " " + repr (args) + " (" + str (e) + ")"
+            fp.write (str (datetime.datetime.fromtimestamp (t)) + " " +
+                Log.NAMES [level] + " " + msg + "\n")
+            if queue.empty ():
+                fp.flush ()
+        fp.close ()
+
+    @staticmethod
+    def write (level, fmt, args):
+        queue = Log.queue
+        if queue != None:
+            queue.put ((time.time (), level, fmt, args))
+
+    @staticmethod
+    def debug (fmt, *args):
+        if Log.level <= Log.DEBUG:
+            Log.write (Log.DEBUG, fmt, args)
+
+    @staticmethod
+    def info (fmt, *args):
+        if Log.level <= Log.INFO:
+            Log.write (Log.INFO, fmt, args)
+
+    @staticmethod
+    def warning (fmt, *args):
+        if Log.level <= Log.WARNING:
+            Log.write (Log.WARNING, fmt, args)
+
+    @staticmethod
+    def error (fmt, *args):
+        if Log.level <= Log.ERROR:
+            Log.write (Log.ERROR, fmt, args)
+
+
+class DecisionTimer (object):
+    """
+    Timing record of one decision, written as a JSON line to
+    DecisionTimer.stream, a file or stderr but never stdout, which is the
+    protocol.  There is no record while stream is None (the default).
+
+    The record has the decision number, the street, the seconds of each
+    phase (parse: the lines since the previous decision; ponder: stopping
+    the pondering; equity; rules; output), the total, and for the
+    equity where it came from (cache, preflop, exact or montecarlo) with
+    the Monte Carlo deals, the reused ones and the new deals and
+    evaluations per second (an upper bound with several opponents, the
+    deal stops at the first one that beats us).
+    """
+
+    stream = None
+
+    @staticmethod
+    def open (path):
+        """ Starts recording to path, or to stderr if path is '-' """
+        if path == '-':
+            DecisionTimer.stream = sys.stderr
+        else:
+            DecisionTimer.stream = open (path, 'a')
+
+    def __init__ (self, decision, street, start):
+        self._start = start
+        self._record = {'decision': decision, 'street': street,
+            'phases': {}}
+
+    def add (self, phase, seconds):
+        phases = self._record ['phases']
+        phases [phase] = phases.get (phase, 0.0) + seconds
+
+    def set (self, key, value):
+        self._record [key] = value
+
+    def write (self):
+        self._record ['total'] = time.time () - self._start
+        DecisionTimer.stream.write (json.dumps (self._record,
+            sort_keys = True) + "\n")
+        DecisionTimer.stream.flush ()
+
+
+class DecisionProfiler (object):
+    """
+    cProfile of selected decisions.  selection is None (off), 'all', or a
+    set of decision numbers and street names (preflop, flop, turn, river);
+    the stats of a profiled decision are dumped in pstats format to
+    directory/decision-<number>.prof.
+    """
+
+    STREETS = {0: 'preflop', 3: 'flop', 4: 'turn', 5: 'river'}
+
+    selection = None
+    directory = '.'
+
+    @staticmethod
+    def configure (spec, directory = None):
+        """ spec is 'all' or a comma separated list, as in OMAHA_PROFILE """
+        if spec == 'all':
+            DecisionProfiler.selection = spec
+        else:
+            DecisionProfiler.selection = set (spec.split (','))
+        if directory != None:
+            DecisionProfiler.directory = directory
+
+    @staticmethod
+    def start (decision, street):
+        """ A running profiler if the decision is selected, else None """
+        selection = DecisionProfiler.selection
+        if selection == None:
+            return None
+        if selection != 'all' and str (decision) not in selection and \
+           DecisionProfiler.STREETS [street] not in selection:
+            return None
+        profile = cProfile.Profile ()
+        profile.enable ()
+        return profile
+
+    @staticmethod
+    def stop (profile, decision):
+        profile.disable ()
+        profile.dump_stats (os.path.join (DecisionProfiler.directory,
+            'decision-%d.prof' % decision))
 
 
 class Suit (object):
+    __slots__ = ('_suitCode',)
+
     NAMES = { 'd': 'Diamonds',
         'c' : 'Clubs',
         'h' : 'Hearts' ,
@@ -65,13 +317,22 @@ class Suit (object):
     def getSuitShift (s):
         return Suit.SHIFTS [s]
 
+    @staticmethod
+    def get (s):
+        """ The shared Suit object of the code """
+        return Suit.SUITS [s]
+
     def __eq__ (self, other):
         print self._suitCode 
         print other._suitCode
 
         return self._suitCode == other._suitCode
 
+Suit.SUITS = dict ((s, Suit (s)) for s in Suit.NAMES)
+
 class Height (object):
+    __slots__ = ('_heightCode',)
+
     NUMBERS = {
         '2' : ('2', 0x0001),
         '3' : ('3', 0x0002),
@@ -105,14 +366,22 @@ class Height (object):
     def getHeightValue (h):
         return Height.NUMBERS [h][1]
 
+    @staticmethod
+    def get (h):
+        """ The shared Height object of the code """
+        return Height.HEIGHTS [h]
+
+Height.HEIGHTS = dict ((h, Height (h)) for h in Height.NUMBERS)
+
 class Card (object):
+    __slots__ = ('_height', '_suit', '_cardCode', '_hexValue', '_rank')
 
     def __init__ (self, cardCode):
-        self._height = Height (cardCode[0])
-        self._suit = Suit (cardCode[1])
+        self._height = Height.get (cardCode[0])
+        self._suit = Suit.get (cardCode[1])
         self._cardCode = cardCode
-        self._hexValue = self._height.getValue () << \
-            self._suit.getShift ()
+        self._rank = self._height.getValue ()
+        self._hexValue = self._rank << self._suit.getShift ()
 
     def __str__ (self):
         return str(self._height) + " of " + str( self._suit)
@@ -125,23 +394,63 @@ class Card (object):
     def getCardCode (self):
         return self._cardCode
 
+    @staticmethod
+    def get (cardCode):
+        """ The interned card of the code, see Card.DECK """
+        return Card.CARDS [cardCode]
+
     def __eq__ (self, other):
         return self._cardCode == other._cardCode
 
+# The 52 cards, built once and shared by every Hand and Deck
+Card.DECK = [Card (h + s) for s in Suit.NAMES for h in Height.NUMBERS]
+Card.CARDS = dict ((c._cardCode, c) for c in Card.DECK)
+
 
 class Hand (object):
+    __slots__ = ('_cards', '_hexValue', '_couples', '_trios', '_coupleMasks',
+        '_trioMasks', '_omaha')
+
+    # Positions of the couples and trios of a hand of n cards
+    COUPLE_INDEXES = [[(i, j) for i in range (0, n - 1)
+        for j in range (i + 1, n)] for n in range (0, 10)]
+    TRIO_INDEXES = [[(i, j, k) for i in range (0, n - 2)
+        for j in range (i + 1, n - 1) for k in range (j + 1, n)]
+        for n in range (0, 10)]
 
     def __init__ (self):
         self._cards = []
         self._hexValue = 0
         self._couples = 'None'
         self._trios = 'None'
+        self._coupleMasks = 'None'
+        self._trioMasks = 'None'
+        self._omaha = 'None'
 
     def addCard (self, c):
         self._cards.append (c)
         self._hexValue |= c._hexValue
         self._couples = 'None'
         self._trios = 'None'
+        self._coupleMasks = 'None'
+        self._trioMasks = 'None'
+        self._omaha = 'None'
+
+    def clear (self):
+        """ Removes all the cards, so the hand can be reused """
+        self.truncate (0)
+
+    def truncate (self, n):
+        """ Keeps only the first n cards """
+        del self._cards [n:]
+        self._hexValue = 0
+        for c in self._cards:
+            self._hexValue |= c._hexValue
+        self._couples = 'None'
+        self._trios = 'None'
+        self._coupleMasks = 'None'
+        self._trioMasks = 'None'
+        self._omaha = 'None'
 
     def __str__ (self):
         strValue = ""
@@ -171,39 +480,47 @@ class Hand (object):
     def parseHand (self, handStr):
         cards = handStr[1:-1].split (",")
         for c in cards:
-            self.addCard (Card (c))
+            self.addCard (Card.get (c))
 
     def getCouples (self):
         if self._couples == 'None':
             self._couples = []
-            for i in range (0, len(self._cards) -1):
-                for j in range (i+1, len (self._cards)):
-                    h = Hand ()
-                    h.addCard (self._cards [i])
-                    h.addCard (self._cards [j])
-                    self._couples.append (h)
+            for i, j in Hand.COUPLE_INDEXES [len (self._cards)]:
+                h = Hand ()
+                h.addCard (self._cards [i])
+                h.addCard (self._cards [j])
+                self._couples.append (h)
         return self._couples
 
     def getTrios (self):
         if self._trios == 'None':
             self._trios = []
-            for i in range (0, len(self._cards) - 2):
-                for j in range (i+1, len (self._cards) -1):
-                    for k in range (j+1, len (self._cards)):
-                        h = Hand ()
-                        h.addCard (self._cards [i])
-                        h.addCard (self._cards [j])
-                        h.addCard (self._cards [k])
-                        self._trios.append (h)
+            for i, j, k in Hand.TRIO_INDEXES [len (self._cards)]:
+                h = Hand ()
+                h.addCard (self._cards [i])
+                h.addCard (self._cards [j])
+                h.addCard (self._cards [k])
+                self._trios.append (h)
         return self._trios
 
+    def getCoupleMasks (self):
+        """ Same as getCouples but as card masks """
+        if self._coupleMasks == 'None':
+            v = [c._hexValue for c in self._cards]
+            self._coupleMasks = [v [i] | v [j]
+                for i, j in Hand.COUPLE_INDEXES [len (v)]]
+        return self._coupleMasks
+
+    def getTrioMasks (self):
+        """ Same as getTrios but as card masks """
+        if self._trioMasks == 'None':
+            v = [c._hexValue for c in self._cards]
+            self._trioMasks = [v [i] | v [j] | v [k]
+                for i, j, k in Hand.TRIO_INDEXES [len (v)]]
+        return self._trioMasks
+
     def cardInHand (self, card):
-        found = False
-        for c in self._cards:
-            if c == card:
-                found = True
-                break
-        return found
+        return (self._hexValue & card._hexValue) != 0
 
     def __add__ (self, other):
         H = Hand ()
@@ -219,30 +536,61 @@ class Hand (object):
             H.addCard (c)
         return H
 
-class Maze (object):
+class Deck (object):
+    '''
+    The cards still in play for one decision: the dead cards (our hand and
+    the table) are taken out once, then every iteration only shuffles the
+    cards it is going to deal (partial Fisher-Yates).
+    '''
+    __slots__ = ('_cards', '_index', '_random')
 
-    def __init__ (self):
-        self._cards = []
+    def __init__ (self, dead = 0, random = None):
+        self._cards = [c for c in Card.DECK if c._hexValue & dead == 0]
+        self._index = 0
+        if random == None:
+            random = Random.generator
+        self._random = random
 
-        for s in Suit.NAMES:
-            for h in Height.NUMBERS:
-                self._cards.append ( Card (h + s))
+    def __len__ (self):
+        return len (self._cards)
 
-    def shuffle (self):
-        Random.shuffle (self._cards)
+    def shuffle (self, k):
+        ''' Puts k random cards at the top of the deck and deals from there '''
+        cards = self._cards
+        n = len (cards)
+        R = self._random
+        x = R._state
+        for i in range (0, k):
+            # Inlined Random.next64 / Random.below
+            x ^= x >> 12
+            x ^= (x << 25) & Random.MASK
+            x ^= x >> 27
+            j = i + (((((x * 0x2545F4914F6CDD1D) & Random.MASK) >> 11) *
+                (n - i)) >> 53)
+            cards [i], cards [j] = cards [j], cards [i]
+        R._state = x
         self._index = 0
 
-    def __str__ (self):
-        mazeStr  = ""
-        for c in self._cards:
-            mazeStr += str(c) + "\n"
-        return mazeStr
-
     def deal (self):
         c = self._cards [self._index]
         self._index += 1
         return c
 
+    def sample (self, k):
+        '''
+        k different random cards, uniform over the subsets of k live cards,
+        without touching the order of the deck (Floyd's algorithm)
+        '''
+        n = len (self._cards)
+        chosen = set ()
+        for j in range (n - k, n):
+            t = self._random.below (j + 1)
+            if t in chosen:
+                chosen.add (j)
+            else:
+                chosen.add (t)
+        return [self._cards [t] for t in chosen]
+
 class Evaluate (object):
 
     NO_PAIR = 0
@@ -269,19 +617,42 @@ class Evaluate (object):
     STRAIGHTS = [ 0x001F, 0x003E, 0x007C, 0x00F8, 0x01F0, 0x03E0, 
         0x07C0, 0x0F80, 0x1F00]
 
+    # Iterations between two checks of the deadline in countWins
+    DEADLINE_CHECK = 50
+
     ARRAY_SIZE = 0x1FC0 + 1
     ACE_RANK = 14
 
-    noOfRanks = []
-    hiRank = []
-    hiUpTo5Ranks = []
+    # The rank tables, generated by gentables.py and loaded at start up;
+    # tuples, built once and shared
+    TABLE_FILE = os.path.join (os.path.dirname (os.path.abspath (__file__)),
+        'ranks.tbl')
+    MAGIC = 'RKT1'
+
+    noOfRanks = ()
+    hiRank = ()
+    hiUpTo5Ranks = ()
+
+    # 5 card evaluator used by eval9cards, replaced by
+    # LookupEvaluate.eval5 when its tables are available
+    backend = None
+
+    # Best Omaha hand evaluator used by calcProbabilities, replaced by
+    # OmahaEvaluate.eval9cards when the LookupEvaluate tables are available
+    evalHand = None
 
 
     @staticmethod
     def initialize ():
-        Evaluate.noOfRanks.append (0)
-        Evaluate.hiRank.append (0)
-        Evaluate.hiUpTo5Ranks.append (0)
+        if not Evaluate.load ():
+            Evaluate.generate ()
+
+    @staticmethod
+    def generate ():
+        """ Builds the rank tables of every rank mask """
+        noOfRanks = [0]
+        hiRank = [0]
+        hiUpTo5Ranks = [0]
         for mask in range (1, Evaluate.ARRAY_SIZE):
             bitCount = 0
             ranks = 0
@@ -294,11 +665,58 @@ class Evaluate (object):
                         ranks <<= Evaluate.RANK_SHIFT_1
                         ranks += i
                         if bitCount == 1:
-                            Evaluate.hiRank.append (i)
+                            hiRank.append (i)
                 i -= 1
                 shiftReg <<= 1
-            Evaluate.hiUpTo5Ranks.append(ranks)
-            Evaluate.noOfRanks.append (bitCount)
+            hiUpTo5Ranks.append(ranks)
+            noOfRanks.append (bitCount)
+        Evaluate.noOfRanks = tuple (noOfRanks)
+        Evaluate.hiRank = tuple (hiRank)
+        Evaluate.hiUpTo5Ranks = tuple (hiUpTo5Ranks)
+
+    @staticmethod
+    def save (path = None):
+        if path == None:
+            path = Evaluate.TABLE_FILE
+        fp = open (path, 'wb')
+        fp.write (Evaluate.MAGIC)
+        fp.write (struct.pack ('<i', Evaluate.ARRAY_SIZE))
+        array ('B', Evaluate.noOfRanks).tofile (fp)
+        array ('B', Evaluate.hiRank).tofile (fp)
+        array ('H', Evaluate.hiUpTo5Ranks).tofile (fp)
+        fp.close ()
+
+    @staticmethod
+    def load (path = None):
+        """ Loads the rank tables, returns False if there is no usable file """
+        if path == None:
+            path = Evaluate.TABLE_FILE
+        try:
+            fp = open (path, 'rb')
+        except IOError:
+            return False
+        try:
+            if fp.read (4) != Evaluate.MAGIC:
+                return False
+            size, = struct.unpack ('<i', fp.read (4))
+            if size != Evaluate.ARRAY_SIZE:
+                return False
+            noOfRanks = array ('B')
+            noOfRanks.fromfile (fp, size)
+            hiRank = array ('B')
+            hiRank.fromfile (fp, size)
+            hiUpTo5Ranks = array ('H')
+            hiUpTo5Ranks.fromfile (fp, size)
+        except (EOFError, struct.error):
+            return False
+        finally:
+            fp.close ()
+
+        # Tuples index faster than arrays, which make a new int every time
+        Evaluate.noOfRanks = tuple (noOfRanks)
+        Evaluate.hiRank = tuple (hiRank)
+        Evaluate.hiUpTo5Ranks = tuple (hiUpTo5Ranks)
+        return True
 
 
     @staticmethod
@@ -489,64 +907,2278 @@ class Evaluate (object):
     @staticmethod
     def eval9cards (hand, table):
         score = Evaluate.NO_PAIR
-        C = hand.getCouples ()
-        T = table.getTrios ()
-        for c in C:
-            c_hex = c._hexValue 
+        eval5 = Evaluate.backend
+        C = hand.getCoupleMasks ()
+        T = table.getTrioMasks ()
+        for c_hex in C:
             for t in T:
-                s = Evaluate.eval5(c_hex | t._hexValue)
+                s = eval5(c_hex | t)
                 if s > score:
                     score = s
         return score
 
-    @staticmethod 
-    def getNextCard (hand, table, maze):
-        exitLoop = False
-        while not exitLoop:
-            C = maze.deal ()
-            if not hand.cardInHand (C) and not table.cardInHand (C):
-                exitLoop = True
-        return C
-
     @staticmethod
     def calcProbabilities (hand, table, no_of_players, iterations):
+        wins, done = Evaluate.countWins (hand, table, no_of_players,
+            iterations)
+        return (wins * 100) / done
+
+    @staticmethod
+    def countWins (hand, table, no_of_players, iterations, deadline = None):
+        """
+        Plays iterations random deals and returns (wins, iterations done);
+        ties count as wins. Stops early when time.time () passes deadline.
+        """
+        wins, done = Evaluate.countWinsByPlayers (hand, table, no_of_players,
+            iterations, deadline)
+        return wins [-1], done
+
+    @staticmethod
+    def winsByPlayers (firstBeaters):
+        """
+        firstBeaters [f] counts the deals where opponent f is the first one
+        dealt that beats us (f = no_of_players when nobody does).  We win
+        against p + 1 opponents whenever f > p, so element p of the result
+        is the number of wins against p + 1 opponents.
+        """
+        wins = []
+        total = 0
+        for f in range (len (firstBeaters) - 1, 0, -1):
+            total += firstBeaters [f]
+            wins.append (total)
+        wins.reverse ()
+        return wins
+
+    @staticmethod
+    def countWinsByPlayers (hand, table, no_of_players, iterations,
+            deadline = None, samples = None):
+        """
+        countWins for 1 to no_of_players opponents in one pass: returns
+        (wins, iterations done) where wins [p] counts the wins against the
+        first p + 1 opponents dealt.  The opponents are dealt from the same
+        deck, so card removal is the same as in separate runs, and the deal
+        still stops at the first opponent that beats us.
+
+        The deals are added to samples if it is a StreetSamples, with their
+        HandStatistics details.
+        """
         myScore = 'None'
-        wins = 0
-        M = Maze ()
+        firstBeaters = [0] * (no_of_players + 1)
+        runouts = []
+        firsts = []
+        details = []
+        # Our hand on the board of the spot, for the hand potential
+        myNow = None
+        if samples != None and 3 <= table.getNumberOfCards () < 5:
+            myNow = Evaluate.evalHand (hand, table)
+        D = Deck (hand._hexValue | table._hexValue)
+        needed = 5 - table.getNumberOfCards () + 4 * no_of_players
+        T = table.clone ()
+        H = Hand ()
+
+        # Score the opponents through a BoardTable when there are enough of
+        # them on the same board: the whole run on the river, or a single
+        # runout with many players
+        B = None
+        if table.getNumberOfCards () == 5 and \
+           BoardTable.paysOff (iterations * no_of_players):
+            B = BoardTable (table)
+        tablePerRunout = BoardTable.paysOff (no_of_players)
         
         for i in range (0, iterations):
-            M.shuffle ()
+            D.shuffle (needed)
 
-            T = table.clone ()
+            T.truncate (table.getNumberOfCards ())
 
             for j in range (table.getNumberOfCards (), 5):
-                T.addCard (Evaluate.getNextCard (hand, table, M))
+                T.addCard (D.deal ())
 
             if (table.getNumberOfCards () < 5) or (myScore == 'None'):
-                myScore = Evaluate.eval9cards (hand, T)
+                myScore = Evaluate.evalHand (hand, T)
+                if tablePerRunout:
+                    B = BoardTable (T)
 
-            Iwin = True
+            first = no_of_players
+            tied = False
             for p in range (0, no_of_players):
-                H = Hand ()
+                H.clear ()
                 for j in range (0, 4):
-                    H.addCard (Evaluate.getNextCard (hand, table, M))
+                    H.addCard (D.deal ())
 
-                otherScore = Evaluate.eval9cards (H, T)
+                if B != None:
+                    otherScore = B.eval9cards (H)
+                else:
+                    otherScore = Evaluate.evalHand (H, T)
 
 #print "I: "+ " 0x%08x " % myScore,
 #print " other " + " 0x%08x " % otherScore
 
+                if p == 0 and samples != None:
+                    final = HandStatistics.relation (myScore, otherScore)
+                    now = HandStatistics.UNKNOWN
+                    if myNow != None:
+                        now = HandStatistics.relation (myNow,
+                            Evaluate.evalHand (H, table))
                 if otherScore > myScore:
-                    Iwin = False
+                    first = p
                     break
+                if otherScore == myScore:
+                    tied = True
+
+            firstBeaters [first] += 1
+            if samples != None:
+                runouts.append (T._hexValue ^ table._hexValue)
+                firsts.append (first)
+                details.append (HandStatistics.pack (myScore, now, final,
+                    tied and first == no_of_players))
+
+            if deadline != None and i % Evaluate.DEADLINE_CHECK == 0 and \
+               time.time () > deadline:
+                break
 
-            if Iwin:
-                wins += 1
-        return (wins * 100) / iterations
+        if samples != None:
+            samples.add (runouts, firsts, details)
+        return Evaluate.winsByPlayers (firstBeaters), sum (firstBeaters)
 
         
 
 Evaluate.initialize ()
+Evaluate.backend = staticmethod (Evaluate.eval5)
+Evaluate.evalHand = staticmethod (Evaluate.eval9cards)
+
+class LookupEvaluate (object):
+    """
+    Table driven replacement for Evaluate.eval5.
+
+    A 5 card mask is either a flush, looked up directly by its 13 bit rank
+    mask, or it is identified by its rank signature (the rank mask plus the
+    sum of the four suit fields, which is unique for 5 cards).  The
+    signatures are mapped to a dense table with a minimal perfect hash
+    (hash and displace), so a lookup costs a displacement read and a value
+    read.  The strengths are the same numbers Evaluate.eval5 returns.
+
+    The tables are generated offline by gentables.py and loaded at start up.
+    """
+
+    TABLE_FILE = os.path.join (os.path.dirname (os.path.abspath (__file__)),
+        'eval5.tbl')
+    MAGIC = 'E5T1'
+
+    flush = []
+    disp = []
+    values = []
+    noOfBuckets = 0
+    tableSize = 0
+
+    @staticmethod
+    def rankKey (hand):
+        """ Rank signature of a 5 card mask """
+        ranks = (hand | hand >> 16 | hand >> 32 | hand >> 48) & 0x1FFF
+        total = (hand + (hand >> 16) + (hand >> 32) + (hand >> 48)) & 0xFFFF
+        return ranks << 16 | total
+
+    @staticmethod
+    def rankMultisets ():
+        """ Returns a non flush 5 card mask for every rank multiset """
+        masks = []
+        stack = [(0, 5, 0, 0)]
+        while len (stack) > 0:
+            start, left, mask, singles = stack.pop ()
+            if left == 0:
+                masks.append (mask)
+                continue
+            for r in range (start, 13):
+                for count in range (1, min (4, left) + 1):
+                    m = mask
+                    if count == 1:
+                        # Rotate the suit of the single cards so five
+                        # different ranks never end up in a flush
+                        m |= (1 << r) << (16 * (singles % 4))
+                        stack.append ((r + 1, left - 1, m, singles + 1))
+                    else:
+                        for s in range (0, count):
+                            m |= (1 << r) << (16 * s)
+                        stack.append ((r + 1, left - count, m, singles))
+        return masks
+
+    @staticmethod
+    def generate ():
+        """ Builds the tables from Evaluate.eval5. Slow, meant for offline """
+        flush = [0] * 0x2000
+        for r in range (0, 0x2000):
+            if bin (r).count ('1') == 5:
+                flush [r] = Evaluate.eval5 (r)
+
+        strengths = {}
+        for mask in LookupEvaluate.rankMultisets ():
+            strengths [LookupEvaluate.rankKey (mask)] = Evaluate.eval5 (mask)
+
+        tableSize = len (strengths)
+        noOfBuckets = tableSize // 5
+        buckets = [[] for b in range (0, noOfBuckets)]
+        for key in strengths:
+            buckets [key % noOfBuckets].append (key)
+        buckets.sort (key = len, reverse = True)
+
+        disp = [0] * noOfBuckets
+        values = [0] * tableSize
+        used = [False] * tableSize
+        for keys in buckets:
+            if len (keys) == 0:
+                break
+            d = 0
+            while True:
+                slots = [(k ^ d) % tableSize for k in keys]
+                if len (set (slots)) == len (slots):
+                    free = True
+                    for s in slots:
+                        if used [s]:
+                            free = False
+                            break
+                    if free:
+                        break
+                d += 1
+            disp [keys [0] % noOfBuckets] = d
+            for k, s in zip (keys, slots):
+                used [s] = True
+                values [s] = strengths [k]
+
+        LookupEvaluate.flush = flush
+        LookupEvaluate.disp = disp
+        LookupEvaluate.values = values
+        LookupEvaluate.noOfBuckets = noOfBuckets
+        LookupEvaluate.tableSize = tableSize
+
+    @staticmethod
+    def save (path = None):
+        if path == None:
+            path = LookupEvaluate.TABLE_FILE
+        fp = open (path, 'wb')
+        fp.write (LookupEvaluate.MAGIC)
+        fp.write (struct.pack ('<ii', LookupEvaluate.noOfBuckets,
+            LookupEvaluate.tableSize))
+        array ('i', LookupEvaluate.flush).tofile (fp)
+        array ('i', LookupEvaluate.disp).tofile (fp)
+        array ('i', LookupEvaluate.values).tofile (fp)
+        fp.close ()
+
+    @staticmethod
+    def load (path = None):
+        """ Loads the tables, returns False if there is no usable file """
+        if path == None:
+            path = LookupEvaluate.TABLE_FILE
+        try:
+            fp = open (path, 'rb')
+        except IOError:
+            return False
+        try:
+            if fp.read (4) != LookupEvaluate.MAGIC:
+                return False
+            noOfBuckets, tableSize = struct.unpack ('<ii', fp.read (8))
+            flush = array ('i')
+            flush.fromfile (fp, 0x2000)
+            disp = array ('i')
+            disp.fromfile (fp, noOfBuckets)
+            values = array ('i')
+            values.fromfile (fp, tableSize)
+        except (EOFError, struct.error):
+            return False
+        finally:
+            fp.close ()
+
+        LookupEvaluate.flush = flush
+        LookupEvaluate.disp = disp
+        LookupEvaluate.values = values
+        LookupEvaluate.noOfBuckets = noOfBuckets
+        LookupEvaluate.tableSize = tableSize
+        return True
+
+    @staticmethod
+    def initialize ():
+        if LookupEvaluate.load ():
+            OmahaEvaluate.initialize ()
+            Evaluate.backend = staticmethod (LookupEvaluate.eval5)
+            Evaluate.evalHand = staticmethod (OmahaEvaluate.eval9cards)
+
+    @staticmethod
+    def eval5 (hand):
+        """ Receives a long number returns strength """
+        ranks = (hand | hand >> 16 | hand >> 32 | hand >> 48) & 0x1FFF
+        f = LookupEvaluate.flush [ranks]
+        if f != 0 and (hand == ranks or hand == ranks << 16 or \
+                hand == ranks << 32 or hand == ranks << 48):
+            return f
+        key = ranks << 16 | \
+            ((hand + (hand >> 16) + (hand >> 32) + (hand >> 48)) & 0xFFFF)
+        return LookupEvaluate.values [(key ^ LookupEvaluate.disp [
+            key % LookupEvaluate.noOfBuckets]) % LookupEvaluate.tableSize]
+
+
+class OmahaEvaluate (object):
+    """
+    Best Omaha hand (2 hole cards + 3 board cards) without trying the 60
+    combinations one by one.
+
+    - Flushes are only tried for suits with 3 or more board cards and 2 or
+      more hole cards, using the LookupEvaluate flush table.
+    - Everything else only depends on ranks, so couples and trios are
+      reduced to their rank signatures (rank mask, rank sum), which add up
+      to the signature looked up in the LookupEvaluate rank table.
+    - Trios are sorted by the best category they can reach and the search
+      stops once the score found can't be beaten.
+
+    The result is the same number Evaluate.eval9cards returns.
+    Needs the LookupEvaluate tables.
+    """
+
+    straightTrios = []
+
+    @staticmethod
+    def subsets (ranks, size):
+        """ Rank masks of every subset of size bits of ranks """
+        bits = []
+        r = ranks
+        while r != 0:
+            b = r & -r
+            bits.append (b)
+            r ^= b
+        masks = []
+        if size == 2:
+            for i in range (0, len (bits) - 1):
+                for j in range (i + 1, len (bits)):
+                    masks.append (bits [i] | bits [j])
+        else:
+            for i in range (0, len (bits) - 2):
+                for j in range (i + 1, len (bits) - 1):
+                    for k in range (j + 1, len (bits)):
+                        masks.append (bits [i] | bits [j] | bits [k])
+        return masks
+
+    @staticmethod
+    def initialize ():
+        """ Marks the 3 rank masks that fit in a straight """
+        OmahaEvaluate.straightTrios = [False] * 0x2000
+        for s in Evaluate.STRAIGHTS + [0x100F]:
+            for t in OmahaEvaluate.subsets (s, 3):
+                OmahaEvaluate.straightTrios [t] = True
+
+    @staticmethod
+    def getHandInfo (hand):
+        """ Rank signatures of the couples, cached in the hand """
+        if hand._omaha == 'None':
+            ranks = [c._rank for c in hand._cards]
+            couples = []
+            for i in range (0, len (ranks) - 1):
+                for j in range (i + 1, len (ranks)):
+                    couples.append ((ranks [i] | ranks [j],
+                        ranks [i] + ranks [j]))
+            hand._omaha = couples
+        return hand._omaha
+
+    @staticmethod
+    def getBoardInfo (table):
+        """
+        Rank signatures of the trios sorted by the best category they can
+        reach, and the trios of the suits that can make a flush. Cached.
+        """
+        if table._omaha == 'None':
+            ranks = [c._rank for c in table._cards]
+            n = len (ranks)
+            trios = set ()
+            for i in range (0, n - 2):
+                for j in range (i + 1, n - 1):
+                    for k in range (j + 1, n):
+                        r = ranks [i] | ranks [j] | ranks [k]
+                        total = ranks [i] + ranks [j] + ranks [k]
+                        if r != total:
+                            # A paired trio can reach four of a kind
+                            bound = Evaluate.STRAIGHT_FLUSH
+                        elif OmahaEvaluate.straightTrios [r]:
+                            bound = Evaluate.FLUSH
+                        else:
+                            bound = Evaluate.STRAIGHT
+                        trios.add ((bound, r, total))
+            flushSuits = []
+            for shift in (0, 16, 32, 48):
+                suitRanks = (table._hexValue >> shift) & 0x1FFF
+                if Evaluate.noOfRanks [suitRanks] >= 3:
+                    flushSuits.append ((shift,
+                        OmahaEvaluate.subsets (suitRanks, 3)))
+            table._omaha = (sorted (trios, reverse = True), flushSuits)
+        return table._omaha
+
+    @staticmethod
+    def bestFlush (hand, flushSuits):
+        score = Evaluate.NO_PAIR
+        flush = LookupEvaluate.flush
+        for shift, trios in flushSuits:
+            suitRanks = (hand._hexValue >> shift) & 0x1FFF
+            if Evaluate.noOfRanks [suitRanks] < 2:
+                continue
+            for c in OmahaEvaluate.subsets (suitRanks, 2):
+                for t in trios:
+                    s = flush [c | t]
+                    if s > score:
+                        score = s
+        return score
+
+    @staticmethod
+    def eval9cards (hand, table):
+        trios, flushSuits = OmahaEvaluate.getBoardInfo (table)
+        score = Evaluate.NO_PAIR
+        if len (flushSuits) > 0:
+            score = OmahaEvaluate.bestFlush (hand, flushSuits)
+
+        values = LookupEvaluate.values
+        disp = LookupEvaluate.disp
+        noOfBuckets = LookupEvaluate.noOfBuckets
+        tableSize = LookupEvaluate.tableSize
+        couples = OmahaEvaluate.getHandInfo (hand)
+        for bound, rt, st in trios:
+            if score >= bound:
+                break
+            for rc, sc in couples:
+                key = (rc | rt) << 16 | (sc + st)
+                s = values [(key ^ disp [key % noOfBuckets]) % tableSize]
+                if s > score:
+                    score = s
+        return score
+
+
+class BoardTable (object):
+    """
+    Best strength of every live couple on a fixed board.
+
+    With the board known, the best Omaha hand of any holding is the best of
+    its 6 couples, and the value of a couple only depends on the couple and
+    the board.  The table stores that value for each of the (at most 1081)
+    couples of cards not on the board, so a hand is scored with 6 lookups.
+
+    Non flush values are computed once per pair of ranks, flushes are added
+    for the suited couples of the suits with 3 or more board cards.
+    """
+    __slots__ = ('_strengths',)
+
+    # Number of hands to score on one board above which building the table
+    # is cheaper than evaluating every hand
+    BREAK_EVEN = 100
+
+    def __init__ (self, table):
+        trios, flushSuits = OmahaEvaluate.getBoardInfo (table)
+        values = LookupEvaluate.values
+        disp = LookupEvaluate.disp
+        noOfBuckets = LookupEvaluate.noOfBuckets
+        tableSize = LookupEvaluate.tableSize
+        flush = LookupEvaluate.flush
+        flushTrios = dict (flushSuits)
+
+        live = [c for c in Card.DECK if not table.cardInHand (c)]
+        byRanks = {}
+        self._strengths = {}
+        for i in range (0, len (live) - 1):
+            c1 = live [i]
+            for j in range (i + 1, len (live)):
+                c2 = live [j]
+                rc = c1._rank | c2._rank
+                sc = c1._rank + c2._rank
+                score = byRanks.get (rc << 16 | sc)
+                if score == None:
+                    score = Evaluate.NO_PAIR
+                    for bound, rt, st in trios:
+                        if score >= bound:
+                            break
+                        key = (rc | rt) << 16 | (sc + st)
+                        s = values [(key ^ disp [key % noOfBuckets]) % tableSize]
+                        if s > score:
+                            score = s
+                    byRanks [rc << 16 | sc] = score
+                if c1._suit is c2._suit and c1._suit.getShift () in flushTrios:
+                    for t in flushTrios [c1._suit.getShift ()]:
+                        s = flush [rc | t]
+                        if s > score:
+                            score = s
+                self._strengths [c1._hexValue | c2._hexValue] = score
+
+    @staticmethod
+    def paysOff (noOfHands):
+        return LookupEvaluate.tableSize > 0 and \
+            noOfHands >= BoardTable.BREAK_EVEN
+
+    def eval9cards (self, hand):
+        """ Same as Evaluate.eval9cards (hand, table) for the table's board """
+        strengths = self._strengths
+        score = Evaluate.NO_PAIR
+        for c in hand.getCoupleMasks ():
+            s = strengths [c]
+            if s > score:
+                score = s
+        return score
+
+
+class ExactEquity (object):
+    """
+    Exact heads up equity on the river, and on the turn by enumerating the
+    river cards too.
+
+    On a fixed board a holding beats our score if any of its 6 couples
+    does, so the holdings that don't beat us are the 4-cliques of the graph
+    of live cards joined by the couples (from a BoardTable) that score no
+    more than us.  Counting those cliques with bit sets gives the exact
+    win/tie/loss split over all C(n, 4) opponent holdings without
+    enumerating them.
+
+    Against an OpponentRange the holdings don't count the same, so they
+    are enumerated instead: every live holding is scored at once with
+    numpy, through the strengths of the couples of the board, and counts
+    for the weight of its class.
+    """
+
+    # Running estimates of the seconds needed for one 5 card board, against
+    # every holding and against a weighted range
+    boardTime = 0.05
+    rangedBoardTime = 0.05
+
+    @staticmethod
+    def countCliques (adj):
+        """ 4-cliques of a graph where adj [i] has the neighbours j > i """
+        count = 0
+        for a in range (0, len (adj)):
+            na = adj [a]
+            while na != 0:
+                bBit = na & -na
+                na ^= bBit
+                nab = adj [a] & adj [bBit.bit_length () - 1]
+                x = nab
+                while x != 0:
+                    cBit = x & -x
+                    x ^= cBit
+                    count += bin (nab & adj [cBit.bit_length () - 1]).count ('1')
+        return count
+
+    @staticmethod
+    def riverCounts (hand, table):
+        """ (wins, ties, losses) over every opponent holding """
+        B = BoardTable (table)
+        strengths = B._strengths
+        myScore = B.eval9cards (hand)
+        dead = hand._hexValue | table._hexValue
+        live = [c._hexValue for c in Card.DECK if c._hexValue & dead == 0]
+        n = len (live)
+        notAbove = [0] * n
+        below = [0] * n
+        for i in range (0, n - 1):
+            for j in range (i + 1, n):
+                s = strengths [live [i] | live [j]]
+                if s <= myScore:
+                    notAbove [i] |= 1 << j
+                    if s < myScore:
+                        below [i] |= 1 << j
+        total = n * (n - 1) * (n - 2) * (n - 3) / 24
+        le = ExactEquity.countCliques (notAbove)
+        lt = ExactEquity.countCliques (below)
+        return lt, le - lt, total - le
+
+    @staticmethod
+    def weightedCounts (hand, table, weights):
+        """
+        (wins, ties, losses) for a board of 4 or 5 cards, every opponent
+        holding counting for the weight of its OpponentRange class
+        """
+        dead = hand._hexValue | table._hexValue
+        live = numpy.nonzero ((OpponentRange.holdings & dead) == 0) [0]
+        holdings = OpponentRange.holdings.take (live)
+        holdingWeights = weights.take (OpponentRange.holdingClasses.take (live))
+        couples = [c.take (live) for c in OpponentRange.holdingCouples]
+        myCouples = BatchEvaluate.holdingCouples (numpy.array (
+            [hand._hexValue], dtype = numpy.int64))
+        board = [c._hexValue for c in table._cards]
+        if len (board) == 5:
+            boards = [board]
+        else:
+            boards = [board + [c._hexValue] for c in Card.DECK
+                if c._hexValue & dead == 0]
+        wins = ties = losses = 0.0
+        for cards in boards:
+            strengths = BatchEvaluate.coupleStrengths (numpy.array (cards,
+                dtype = numpy.int64))
+            scores = BatchEvaluate.holdingScores (strengths, couples)
+            myScore = BatchEvaluate.holdingScores (strengths, myCouples) [0]
+            w = holdingWeights * ((holdings & cards [4]) == 0)
+            below = w [scores < myScore].sum ()
+            notAbove = w [scores <= myScore].sum ()
+            wins += below
+            ties += notAbove - below
+            losses += w.sum () - notAbove
+        return wins, ties, losses
+
+    @staticmethod
+    def counts (hand, table, weights = None):
+        """
+        (wins, ties, losses) for a board of 4 or 5 cards, with the class
+        weights of an OpponentRange if there are weights
+        """
+        start = time.time ()
+        if weights is not None:
+            result = ExactEquity.weightedCounts (hand, table, weights)
+            boards = 1
+            if table.getNumberOfCards () == 4:
+                boards = 44
+            ExactEquity.rangedBoardTime = (time.time () - start) / boards
+            return result
+        if table.getNumberOfCards () == 5:
+            result = ExactEquity.riverCounts (hand, table)
+            boards = 1
+        else:
+            wins = ties = losses = 0
+            T = table.clone ()
+            dead = hand._hexValue | table._hexValue
+            boards = 0
+            for c in Card.DECK:
+                if c._hexValue & dead != 0:
+                    continue
+                T.truncate (table.getNumberOfCards ())
+                T.addCard (c)
+                w, t, l = ExactEquity.riverCounts (hand, T)
+                wins += w
+                ties += t
+                losses += l
+                boards += 1
+            result = (wins, ties, losses)
+        ExactEquity.boardTime = (time.time () - start) / boards
+        return result
+
+    @staticmethod
+    def fits (table, no_of_players, seconds, ranged = False):
+        """
+        True if the exact calculation is expected to take < seconds,
+        against a weighted range if ranged
+        """
+        if no_of_players != 1 or LookupEvaluate.tableSize == 0:
+            return False
+        if ranged and not OpponentRange.available ():
+            return False
+        if table.getNumberOfCards () == 5:
+            boards = 1
+        elif table.getNumberOfCards () == 4:
+            boards = 44
+        else:
+            return False
+        if ranged:
+            return boards * ExactEquity.rangedBoardTime < seconds
+        return boards * ExactEquity.boardTime < seconds
+
+    @staticmethod
+    def calcProbabilities (hand, table, counts = None):
+        """
+        Same meaning as Evaluate.calcProbabilities, ties count as wins;
+        counts are the counts of the spot when they are already known
+        """
+        if counts == None:
+            counts = ExactEquity.counts (hand, table)
+        wins, ties, losses = counts
+        return ((wins + ties) * 100) // (wins + ties + losses)
+
+
+class BatchEvaluate (object):
+    """
+    Monte Carlo with numpy: every iteration of a run is dealt at once into
+    arrays of 64 bit card masks (the Card._hexValue layout) and eval5 is
+    applied to whole arrays through the LookupEvaluate tables, whose perfect
+    hash needs no branches.  The best hand of every player is the maximum
+    over the 6 x 10 couple/trio combinations of its row.
+
+    Only available when numpy is installed and the tables are loaded.
+    """
+
+    # Iterations evaluated per numpy pass, bounds the memory used
+    CHUNK = 5000
+
+    COUPLES = [(i, j) for i in range (0, 3) for j in range (i + 1, 4)]
+    # The trios of a board, by its number of cards
+    TRIOS = dict ((n, list (itertools.combinations (range (0, n), 3)))
+        for n in (3, 4, 5))
+
+    flush = None
+    disp = None
+    values = None
+    # The deck sorted by mask and its couples; the couple of the cards
+    # i < j of the deck is number i * 52 + j, see coupleStrengths
+    deck = None
+    deckCouples = None
+    coupleIndexes = None
+
+    @staticmethod
+    def available ():
+        return numpy != None and LookupEvaluate.tableSize > 0
+
+    @staticmethod
+    def initialize ():
+        if not BatchEvaluate.available ():
+            return
+        BatchEvaluate.flush = numpy.array (LookupEvaluate.flush,
+            dtype = numpy.int64)
+        BatchEvaluate.disp = numpy.array (LookupEvaluate.disp,
+            dtype = numpy.int64)
+        BatchEvaluate.values = numpy.array (LookupEvaluate.values,
+            dtype = numpy.int64)
+        deck = numpy.array (sorted ([c._hexValue for c in Card.DECK]),
+            dtype = numpy.int64)
+        first, second = numpy.triu_indices (len (deck), 1)
+        BatchEvaluate.deck = deck
+        BatchEvaluate.deckCouples = deck [first] | deck [second]
+        BatchEvaluate.coupleIndexes = first * len (deck) + second
+
+    @staticmethod
+    def eval5 (masks):
+        """ Receives an array of 5 card masks returns their strengths """
+        ranks = (masks | masks >> 16 | masks >> 32 | masks >> 48) & 0x1FFF
+        f = BatchEvaluate.flush [ranks]
+        isFlush = (f != 0) & ((masks == ranks) | (masks == ranks << 16) |
+            (masks == ranks << 32) | (masks == ranks << 48))
+        keys = ranks << 16 | \
+            ((masks + (masks >> 16) + (masks >> 32) + (masks >> 48)) & 0xFFFF)
+        slots = (keys ^ BatchEvaluate.disp [keys % LookupEvaluate.noOfBuckets]) \
+            % LookupEvaluate.tableSize
+        return numpy.where (isFlush, f, BatchEvaluate.values [slots])
+
+    @staticmethod
+    def eval9cards (hands, tables):
+        """
+        hands is an (n, 4) array of card masks and tables an (n, 5) one
+        (or (n, 3), (n, 4) for the boards before the river), returns the n
+        best Omaha hands.
+        """
+        couples = numpy.zeros ((len (hands), 6), dtype = numpy.int64)
+        for c, (i, j) in enumerate (BatchEvaluate.COUPLES):
+            couples [:, c] = hands [:, i] | hands [:, j]
+        boardTrios = BatchEvaluate.TRIOS [tables.shape [1]]
+        trios = numpy.zeros ((len (tables), len (boardTrios)),
+            dtype = numpy.int64)
+        for t, (i, j, k) in enumerate (boardTrios):
+            trios [:, t] = tables [:, i] | tables [:, j] | tables [:, k]
+        strengths = BatchEvaluate.eval5 (couples [:, :, None] |
+            trios [:, None, :])
+        return strengths.reshape (len (hands), -1).max (axis = 1)
+
+    @staticmethod
+    def coupleStrengths (board):
+        """
+        The best Omaha hand of every couple of the deck on board, an array
+        of 5 card masks, as in BoardTable: an array indexed by the couple
+        numbers, 0 for the couples with a board card
+        """
+        dead = numpy.bitwise_or.reduce (board)
+        trios = numpy.array ([board [i] | board [j] | board [k]
+            for i, j, k in BatchEvaluate.TRIOS [5]])
+        live = (BatchEvaluate.deckCouples & dead) == 0
+        strengths = numpy.zeros (len (BatchEvaluate.deck) ** 2,
+            dtype = numpy.int64)
+        strengths [BatchEvaluate.coupleIndexes [live]] = BatchEvaluate.eval5 (
+            BatchEvaluate.deckCouples [live, None] | trios [None, :]).max (
+                axis = 1)
+        return strengths
+
+    @staticmethod
+    def holdingCouples (holdings):
+        """
+        The numbers of the 6 couples of every hand of holdings, an array of
+        hand masks: 6 arrays, see coupleStrengths
+        """
+        deck = BatchEvaluate.deck
+        cards = numpy.empty ((len (holdings), 4), dtype = numpy.int64)
+        rest = holdings.copy ()
+        for i in range (0, 4):
+            low = rest & -rest
+            cards [:, i] = numpy.searchsorted (deck, low)
+            rest ^= low
+        return [cards [:, i] * len (deck) + cards [:, j]
+            for i, j in BatchEvaluate.COUPLES]
+
+    @staticmethod
+    def holdingScores (strengths, couples):
+        """
+        The best Omaha hands of holdings given the coupleStrengths of a
+        board and their holdingCouples
+        """
+        scores = strengths.take (couples [0])
+        for c in couples [1:]:
+            numpy.maximum (scores, strengths.take (c), out = scores)
+        return scores
+
+    @staticmethod
+    def randomState ():
+        """ Seeded from the shared generator so Random.seed reproduces runs """
+        return numpy.random.RandomState (
+            Random.generator.next64 () & 0xFFFFFFFF)
+
+    @staticmethod
+    def deal (live, n, k, rng = None, held = None):
+        """
+        n rows of k different cards taken from the live cards, without the
+        cards of the mask held [row] if held is given
+        """
+        if rng == None:
+            rng = BatchEvaluate.randomState ()
+        keys = rng.random_sample ((n, len (live)))
+        if held is not None:
+            # The held cards sort last
+            keys [(live & held [:, None]) != 0] = 2.0
+        order = keys.argsort (axis = 1)
+        return live [order [:, :k]]
+
+    @staticmethod
+    def chunkSamples (hand, table, no_of_players, iterations,
+            opponents = None, withDetails = False):
+        """
+        Deals iterations runouts and returns the arrays of their board cards
+        masks, of the positions of the first opponent that beats us and of
+        their HandStatistics details (None unless withDetails), as in
+        StreetSamples.  The first opponent's hands are drawn from
+        opponents, a RangeSampler of the spot, when it is given.
+        """
+        handCards = [c._hexValue for c in hand._cards]
+        tableCards = [c._hexValue for c in table._cards]
+        dead = hand._hexValue | table._hexValue
+        live = numpy.array ([c._hexValue for c in Card.DECK
+            if c._hexValue & dead == 0], dtype = numpy.int64)
+        missing = 5 - len (tableCards)
+
+        if opponents == None:
+            dealt = BatchEvaluate.deal (live, iterations,
+                missing + 4 * no_of_players)
+            others = [dealt [:, missing + 4 * p:missing + 4 * p + 4]
+                for p in range (0, no_of_players)]
+        else:
+            rng = BatchEvaluate.randomState ()
+            ranged, rangedMasks = opponents.draw (iterations, rng)
+            dealt = BatchEvaluate.deal (live, iterations,
+                missing + 4 * (no_of_players - 1), rng, rangedMasks)
+            others = [ranged] + [dealt [:, missing + 4 * p:missing + 4 * p + 4]
+                for p in range (0, no_of_players - 1)]
+        tables = numpy.empty ((iterations, 5), dtype = numpy.int64)
+        tables [:, :len (tableCards)] = tableCards
+        tables [:, len (tableCards):] = dealt [:, :missing]
+
+        if missing == 0:
+            myScore = Evaluate.evalHand (hand, table)
+        else:
+            hands = numpy.empty ((iterations, 4), dtype = numpy.int64)
+            hands [:] = handCards
+            myScore = BatchEvaluate.eval9cards (hands, tables)
+
+        # Opponents beaten before the first one that beats us
+        firsts = numpy.zeros (iterations, dtype = numpy.int8)
+        Iwin = numpy.ones (iterations, dtype = bool)
+        Itie = numpy.zeros (iterations, dtype = bool)
+        for p in range (0, no_of_players):
+            otherScore = BatchEvaluate.eval9cards (others [p], tables)
+            if p == 0:
+                final = otherScore
+            Iwin &= otherScore <= myScore
+            Itie |= otherScore == myScore
+            firsts += Iwin
+        runouts = numpy.bitwise_or.reduce (dealt [:, :missing], axis = 1)
+        if not withDetails:
+            return runouts, firsts, None
+
+        # The hand potential compares with the first opponent on the board
+        # of the spot, before the river
+        now = HandStatistics.UNKNOWN
+        if 3 <= len (tableCards) < 5:
+            now = HandStatistics.relation (Evaluate.evalHand (hand, table),
+                BatchEvaluate.eval9cards (others [0],
+                    tables [:, :len (tableCards)]))
+        details = HandStatistics.pack (myScore, now,
+            HandStatistics.relation (myScore, final), Iwin & Itie)
+        return runouts, firsts, details.astype (numpy.int16)
+
+    @staticmethod
+    def countWins (hand, table, no_of_players, iterations, deadline = None):
+        """
+        Same as Evaluate.countWins. The iterations are run in chunks and the
+        run stops early when time.time () passes deadline.
+        """
+        wins, done = BatchEvaluate.countWinsByPlayers (hand, table,
+            no_of_players, iterations, deadline)
+        return wins [-1], done
+
+    @staticmethod
+    def countWinsByPlayers (hand, table, no_of_players, iterations,
+            deadline = None, samples = None, opponents = None):
+        """
+        Same as Evaluate.countWinsByPlayers, the first opponent drawn from
+        opponents as in chunkSamples
+        """
+        wins = [0] * no_of_players
+        done = 0
+        while done < iterations:
+            n = min (BatchEvaluate.CHUNK, iterations - done)
+            runouts, firsts, details = BatchEvaluate.chunkSamples (hand,
+                table, no_of_players, n, opponents, samples != None)
+            for p in range (0, no_of_players):
+                wins [p] += int ((firsts > p).sum ())
+            if samples != None:
+                samples.add (runouts, firsts, details)
+            done += n
+            if deadline != None and time.time () > deadline:
+                break
+        return wins, done
+
+    @staticmethod
+    def calcProbabilities (hand, table, no_of_players, iterations,
+            deadline = None):
+        """ Same result as Evaluate.calcProbabilities """
+        wins, done = BatchEvaluate.countWins (hand, table, no_of_players,
+            iterations, deadline)
+        return (wins * 100) / done
+
+
+def parallelWorker (task):
+    """
+    Runs one share of a ParallelEvaluate run in a pool process.  Module
+    level so the pool can pickle it; cards travel as their codes, the
+    opponent's range as its signature (see OpponentRange.replay) and the
+    samples as their (runouts, firsts, details) chunks.
+    """
+    handCodes, tableCodes, no_of_players, iterations, seed, deadline, \
+        keepSamples, signature = task
+    hand = Hand ()
+    for c in handCodes:
+        hand.addCard (Card.get (c))
+    table = Hand ()
+    for c in tableCodes:
+        table.addCard (Card.get (c))
+    Random.seed (seed)
+    opponents = None
+    if len (signature) > 0:
+        opponents = OpponentRange.replay (signature).sampler (
+            hand._hexValue | table._hexValue)
+    samples = None
+    if keepSamples:
+        samples = StreetSamples (hand, table, no_of_players, signature)
+    if BatchEvaluate.available ():
+        wins, done = BatchEvaluate.countWinsByPlayers (hand, table,
+            no_of_players, iterations, deadline, samples, opponents)
+    else:
+        wins, done = Evaluate.countWinsByPlayers (hand, table, no_of_players,
+            iterations, deadline, samples)
+    if samples != None:
+        return wins, done, samples._chunks
+    return wins, done, None
+
+class ParallelEvaluate (object):
+    """
+    calcProbabilities split over a pool of worker processes.
+
+    The pool is started once and kept warm; the workers are forked after
+    the evaluator tables are loaded.  Every share of a run gets its own
+    seed from the shared generator, so the streams are independent and a
+    seeded run is reproducible.  With a single core (or no multiprocessing)
+    there is no pool and everything runs in process.
+    """
+
+    pool = None
+    noOfWorkers = 1
+
+    @staticmethod
+    def start (noOfWorkers = None):
+        if ParallelEvaluate.pool != None or multiprocessing == None:
+            return
+        if noOfWorkers == None:
+            try:
+                noOfWorkers = multiprocessing.cpu_count ()
+            except NotImplementedError:
+                noOfWorkers = 1
+        if noOfWorkers < 2:
+            return
+        try:
+            ParallelEvaluate.pool = multiprocessing.Pool (noOfWorkers)
+            ParallelEvaluate.noOfWorkers = noOfWorkers
+        except (OSError, ImportError):
+            ParallelEvaluate.pool = None
+
+    @staticmethod
+    def stop ():
+        if ParallelEvaluate.pool != None:
+            ParallelEvaluate.pool.terminate ()
+            ParallelEvaluate.pool = None
+            ParallelEvaluate.noOfWorkers = 1
+
+    @staticmethod
+    def available ():
+        return ParallelEvaluate.pool != None
+
+    @staticmethod
+    def countWinsByPlayers (hand, table, no_of_players, iterations,
+            deadline = None, samples = None, opponents = None):
+        """
+        Same as Evaluate.countWinsByPlayers; opponents is a RangeSampler
+        (see BatchEvaluate.chunkSamples), None for random hands
+        """
+        if ParallelEvaluate.pool == None:
+            if BatchEvaluate.available ():
+                return BatchEvaluate.countWinsByPlayers (hand, table,
+                    no_of_players, iterations, deadline, samples, opponents)
+            return Evaluate.countWinsByPlayers (hand, table, no_of_players,
+                iterations, deadline, samples)
+
+        handCodes = [c._cardCode for c in hand._cards]
+        tableCodes = [c._cardCode for c in table._cards]
+        signature = ()
+        if opponents != None:
+            signature = opponents._signature
+        n = ParallelEvaluate.noOfWorkers
+        tasks = []
+        for w in range (0, n):
+            share = iterations / n
+            if w < iterations % n:
+                share += 1
+            if share > 0:
+                tasks.append ((handCodes, tableCodes, no_of_players, share,
+                    Random.generator.next64 (), deadline, samples != None,
+                    signature))
+        wins = [0] * no_of_players
+        done = 0
+        for w, d, chunks in ParallelEvaluate.pool.map (parallelWorker,
+                tasks):
+            for p in range (0, no_of_players):
+                wins [p] += w [p]
+            done += d
+            if chunks != None:
+                for runouts, firsts, details in chunks:
+                    samples.add (runouts, firsts, details)
+        return wins, done
+
+
+class HandStatistics (object):
+    """
+    What a simulation tells besides the win rate: the ties against all the
+    opponents, the categories of our final hand (the top byte of its
+    strength) and the hand potential against the first opponent dealt
+    (Billings et al.): PPot, the chance to end ahead when behind on the
+    board of the spot, and NPot, to end behind when ahead, ties counting
+    half.  The payoff of a deal is 1 for a win, 1/2 for a tie and 0 for a
+    loss; equity and variance are its mean and variance.
+
+    The deals carry their details packed in an int: the category in bits
+    0-3, the relation (AHEAD, TIED, BEHIND or UNKNOWN) with the first
+    opponent on the board of the spot in bits 4-5 and at the end in bits
+    6-7, and a tie against all the opponents in bit 8.  The relation on the
+    board is UNKNOWN preflop, on the river and for the deals of a previous
+    street.  categories and potential are None when there are no details.
+    """
+
+    AHEAD = 0
+    TIED = 1
+    BEHIND = 2
+    UNKNOWN = 3
+
+    CATEGORIES = ['high card', 'pair', 'two pair', 'three of a kind',
+        'straight', 'flush', 'full house', 'four of a kind',
+        'straight flush']
+
+    @staticmethod
+    def relation (myScore, otherScore):
+        """ AHEAD, TIED or BEHIND, for numbers or numpy arrays """
+        if numpy != None and isinstance (otherScore, numpy.ndarray):
+            return numpy.where (otherScore > myScore, HandStatistics.BEHIND,
+                numpy.where (otherScore == myScore, HandStatistics.TIED,
+                HandStatistics.AHEAD))
+        if otherScore > myScore:
+            return HandStatistics.BEHIND
+        if otherScore == myScore:
+            return HandStatistics.TIED
+        return HandStatistics.AHEAD
+
+    @staticmethod
+    def pack (myScore, now, final, tied):
+        """ The details of a deal, for numbers or numpy arrays """
+        return (myScore >> 24) | now << 4 | final << 6 | tied << 8
+
+    def __init__ (self, done, wins, ties, categories = None,
+            potential = None):
+        """
+        wins counts the deals nobody beats us, ties included (the wins of
+        calcProbabilities); categories the deals by the category of our
+        hand, potential the deals by relation on the board and at the end
+        (potential [now][final])
+        """
+        self._done = done
+        self._wins = wins
+        self._ties = ties
+        self._categories = categories
+        self._potential = potential
+
+    def getDone (self):
+        return self._done
+
+    def getTieRate (self):
+        return float (self._ties) / self._done
+
+    def getEquity (self):
+        return (self._wins - self._ties / 2.0) / self._done
+
+    def getVariance (self):
+        """ Variance of the payoff of a deal """
+        square = (self._wins - self._ties * 0.75) / self._done
+        return square - self.getEquity () ** 2
+
+    def getStandardError (self):
+        """ Standard error of getEquity """
+        return math.sqrt (self.getVariance () / self._done)
+
+    def getCategories (self):
+        """ Share of the deals of every category, or None """
+        if self._categories == None:
+            return None
+        return [float (c) / self._done for c in self._categories]
+
+    def getPotentials (self):
+        """ (PPot, NPot), None if no deal knows its relation on the board """
+        if self._potential == None:
+            return None
+        P = self._potential
+        A, T, B = HandStatistics.AHEAD, HandStatistics.TIED, \
+            HandStatistics.BEHIND
+        behind = sum (P [B]) + sum (P [T]) / 2.0
+        ahead = sum (P [A]) + sum (P [T]) / 2.0
+        if behind + ahead == 0:
+            return None
+        ppot = 0.0
+        if behind > 0:
+            ppot = (P [B][A] + P [B][T] / 2.0 + P [T][A] / 2.0) / behind
+        npot = 0.0
+        if ahead > 0:
+            npot = (P [A][B] + P [A][T] / 2.0 + P [T][B] / 2.0) / ahead
+        return ppot, npot
+
+    def __str__ (self):
+        s = "deals %d equity %.2f%% ties %.2f%% se %.2f%%" % (self._done,
+            self.getEquity () * 100, self.getTieRate () * 100,
+            self.getStandardError () * 100)
+        potentials = self.getPotentials ()
+        if potentials != None:
+            s += " ppot %.2f%% npot %.2f%%" % (potentials [0] * 100,
+                potentials [1] * 100)
+        categories = self.getCategories ()
+        if categories != None:
+            s += " " + ", ".join (["%s %.1f%%" % (name, share * 100)
+                for name, share in zip (HandStatistics.CATEGORIES, categories)
+                if share > 0])
+        return s
+
+
+class StreetSamples (object):
+    """
+    The deals simulated for a (hand, table, no_of_players) spot, kept so
+    the next streets can reuse them.
+
+    A sample is the mask of the board cards the deal added and the number
+    of opponents beaten before the first one that beats us (the position f
+    of Evaluate.winsByPlayers).  When more board cards are revealed, the
+    samples whose runout holds all of them are still uniform deals of the
+    new spot, with the same outcome: advance keeps those, takes the revealed
+    cards out of their runouts and drops the others.  One flop sample in
+    about 23 survives the turn card, one turn sample in 46 the river card.
+
+    The samples are chunks of (runouts, firsts, details), numpy arrays from
+    the batch evaluator and lists from the scalar one, details as in
+    HandStatistics.  The relation on the board of the deals advanced to a
+    later street is UNKNOWN.  Deals of an opponent
+    range only match the same range, signature is its
+    OpponentRange.getSignature.
+    """
+
+    __slots__ = ('_handMask', '_tableMask', '_noOfPlayers', '_signature',
+        '_chunks')
+
+    def __init__ (self, hand, table, no_of_players, signature = ()):
+        self._handMask = hand._hexValue
+        self._tableMask = table._hexValue
+        self._noOfPlayers = no_of_players
+        self._signature = signature
+        self._chunks = []
+
+    def __len__ (self):
+        return sum ([len (firsts) for runouts, firsts, details in
+            self._chunks])
+
+    def matches (self, hand, table, no_of_players, signature = ()):
+        """ True if the samples can be advanced to the spot """
+        return self._handMask == hand._hexValue and \
+            self._noOfPlayers == no_of_players and \
+            self._signature == signature and \
+            self._tableMask & table._hexValue == self._tableMask
+
+    def add (self, runouts, firsts, details):
+        if len (firsts) > 0:
+            self._chunks.append ((runouts, firsts, details))
+
+    def advance (self, table):
+        """ Keeps the samples that are deals of table """
+        revealed = table._hexValue & ~self._tableMask
+        self._tableMask = table._hexValue
+        if revealed == 0:
+            return
+        chunks = self._chunks
+        self._chunks = []
+        unknown = HandStatistics.UNKNOWN << 4
+        for runouts, firsts, details in chunks:
+            if numpy != None and isinstance (runouts, numpy.ndarray):
+                keep = runouts & revealed == revealed
+                self.add (runouts [keep] ^ revealed, firsts [keep],
+                    details [keep] | unknown)
+            else:
+                keep = [n for n, r in enumerate (runouts)
+                    if r & revealed == revealed]
+                self.add ([runouts [n] ^ revealed for n in keep],
+                    [firsts [n] for n in keep],
+                    [details [n] | unknown for n in keep])
+
+    def counts (self):
+        """ (wins, done) as Evaluate.countWinsByPlayers returns them """
+        firstBeaters = [0] * (self._noOfPlayers + 1)
+        for runouts, firsts, details in self._chunks:
+            if numpy != None and isinstance (firsts, numpy.ndarray):
+                histogram = numpy.bincount (firsts,
+                    minlength = self._noOfPlayers + 1)
+                for f in range (0, self._noOfPlayers + 1):
+                    firstBeaters [f] += int (histogram [f])
+            else:
+                for f in firsts:
+                    firstBeaters [f] += 1
+        return Evaluate.winsByPlayers (firstBeaters), sum (firstBeaters)
+
+    def statistics (self):
+        """ The HandStatistics of the samples """
+        wins, done = self.counts ()
+        if done == 0:
+            return None
+        # Histograms of the details without the category, and of the
+        # categories
+        outcomes = [0] * 0x20
+        categories = [0] * len (HandStatistics.CATEGORIES)
+        for runouts, firsts, details in self._chunks:
+            if numpy != None and isinstance (details, numpy.ndarray):
+                histogram = numpy.bincount (details >> 4, minlength = 0x20)
+                for n in range (0, 0x20):
+                    outcomes [n] += int (histogram [n])
+                histogram = numpy.bincount (details & 0xF,
+                    minlength = len (categories))
+                for n in range (0, len (categories)):
+                    categories [n] += int (histogram [n])
+            else:
+                for d in details:
+                    outcomes [d >> 4] += 1
+                    categories [d & 0xF] += 1
+        ties = sum (outcomes [0x10:0x20])
+        potential = [[0] * 3 for n in range (0, 3)]
+        known = 0
+        for now in range (0, 3):
+            for final in range (0, 3):
+                potential [now][final] = outcomes [now | final << 2] + \
+                    outcomes [now | final << 2 | 0x10]
+                known += potential [now][final]
+        if known == 0:
+            potential = None
+        return HandStatistics (done, wins [-1], ties, categories, potential)
+
+
+class AnytimeEquity (object):
+    """
+    calcProbabilities as an anytime estimator: iterations are run in
+    growing rounds until the confidence interval of the win rate no longer
+    contains any of the boundaries where the decision changes (see
+    ActionCalculator.getBoundaries), or the deadline passes, or
+    maxIterations are done.  Clear spots stop after the first rounds, close
+    spots use the whole budget.
+    """
+
+    # Half width of the confidence interval in standard errors
+    CONFIDENCE_Z = 2.0
+
+    @staticmethod
+    def isSettled (wins, done, boundaries):
+        """ True if no boundary is inside the confidence interval """
+        p = float (wins) / done
+        halfWidth = AnytimeEquity.CONFIDENCE_Z * \
+            math.sqrt (max (p * (1.0 - p), 0.25 / done) / done)
+        lo = (p - halfWidth) * 100.0
+        hi = (p + halfWidth) * 100.0
+        for b in boundaries:
+            if lo <= b <= hi:
+                return False
+        return True
+
+    @staticmethod
+    def countWinsByPlayers (hand, table, no_of_players, boundaries, deadline,
+            minIterations, maxIterations, samples = None, opponents = None):
+        """
+        Same as Evaluate.countWinsByPlayers; the stopping rule looks at the
+        wins against all no_of_players opponents.  The run starts from the
+        deals already in samples, a StreetSamples of the spot, and adds the
+        new ones to it.  opponents is a RangeSampler of the spot, see
+        ParallelEvaluate.countWinsByPlayers.
+        """
+        wins = [0] * no_of_players
+        done = 0
+        if samples != None:
+            wins, done = samples.counts ()
+        while done < maxIterations:
+            if done >= minIterations and \
+               AnytimeEquity.isSettled (wins [-1], done, boundaries):
+                break
+            step = min (max (minIterations, done), maxIterations - done)
+            w, d = ParallelEvaluate.countWinsByPlayers (hand, table,
+                no_of_players, step, deadline, samples, opponents)
+            for p in range (0, no_of_players):
+                wins [p] += w [p]
+            done += d
+            if time.time () > deadline:
+                break
+        return wins, done
+
+
+class Ponderer (object):
+    """
+    Deals a spot in a background thread while the bot waits for its Action
+    line, adding them to a StreetSamples that calcProbabilities then starts
+    from.  The thread runs rounds of step deals until stop is called or
+    maxIterations deals are in the samples; stop waits for the round in
+    progress, so the rounds are kept short: a few milliseconds of the
+    decision's time.
+    """
+
+    # Deals per round, with the batch evaluator (a fraction of its CHUNK)
+    # and with the scalar one
+    BATCH_STEP = 1000
+    SCALAR_STEP = Evaluate.DEADLINE_CHECK
+
+    def __init__ (self, hand, table, no_of_players, samples, step,
+            maxIterations, opponents = None):
+        self._hand = hand
+        self._table = table
+        self._noOfPlayers = no_of_players
+        self._samples = samples
+        self._step = step
+        self._maxIterations = maxIterations
+        self._opponents = opponents
+        self._stopEvent = threading.Event ()
+        self._thread = threading.Thread (target = self.run)
+        self._thread.daemon = True
+
+    def start (self):
+        self._thread.start ()
+
+    def stop (self):
+        self._stopEvent.set ()
+        self._thread.join ()
+
+    def run (self):
+        try:
+            while not self._stopEvent.is_set () and \
+                  len (self._samples) < self._maxIterations:
+                ParallelEvaluate.countWinsByPlayers (self._hand, self._table,
+                    self._noOfPlayers, self._step, None, self._samples,
+                    self._opponents)
+        except Exception, e:
+            Log.warning ("pondering stopped: %s", e)
+
+
+class HandIndexer (object):
+    """
+    Suit isomorphic index of a (4 hole cards, n board cards) situation.
+
+    Two situations that only differ by a permutation of the suits get the
+    same index, and the indexes are dense: 0 <= index < size ().  For each
+    suit the hole ranks and the board ranks make a configuration, ranked
+    with the combinatorial number system.  Suits are ordered by their
+    numbers of (hole, board) cards, which gives a pattern; suits with the
+    same counts are interchangeable, so their configurations are ranked as
+    a multiset.  The index is the offset of the pattern plus the mixed
+    radix number of its groups.  unrank goes back to a canonical situation.
+
+    One instance per board size, see HandIndexer.get.
+    """
+
+    HOLE_CARDS = 4
+    SHIFTS = (0, 16, 32, 48)
+
+    indexers = {}
+
+    def __init__ (self, boardCards):
+        self._boardCards = boardCards
+        # Every way to spread the cards over the suits, with the suits
+        # sorted by decreasing (hole, board) counts
+        counts = sorted ([(h, b) for h in range (0, HandIndexer.HOLE_CARDS + 1)
+            for b in range (0, boardCards + 1)], reverse = True)
+        self._patterns = []
+        for pattern in itertools.combinations_with_replacement (counts, 4):
+            if sum ([h for h, b in pattern]) == HandIndexer.HOLE_CARDS and \
+               sum ([b for h, b in pattern]) == boardCards:
+                self._patterns.append (pattern)
+        self._patternIndex = {}
+        self._groups = []
+        self._offsets = []
+        offset = 0
+        for n, pattern in enumerate (self._patterns):
+            self._patternIndex [pattern] = n
+            groups = []
+            size = 1
+            for counts in sorted (set (pattern), reverse = True):
+                m = pattern.count (counts)
+                configs = HandIndexer.choose (13, counts [0]) * \
+                    HandIndexer.choose (13 - counts [0], counts [1])
+                groupSize = HandIndexer.choose (configs + m - 1, m)
+                groups.append ((counts, m, configs, groupSize))
+                size *= groupSize
+            self._groups.append (groups)
+            self._offsets.append (offset)
+            offset += size
+        self._size = offset
+
+    @staticmethod
+    def get (boardCards):
+        """ The shared indexer of a board size """
+        if boardCards not in HandIndexer.indexers:
+            HandIndexer.indexers [boardCards] = HandIndexer (boardCards)
+        return HandIndexer.indexers [boardCards]
+
+    @staticmethod
+    def choose (n, k):
+        if k < 0 or k > n:
+            return 0
+        c = 1
+        for i in range (0, k):
+            c = c * (n - i) / (i + 1)
+        return c
+
+    @staticmethod
+    def rankSet (bits):
+        """ Colex rank of a set of ranks """
+        rank = 0
+        i = 1
+        r = 0
+        while bits != 0:
+            if bits & 1:
+                rank += HandIndexer.choose (r, i)
+                i += 1
+            bits >>= 1
+            r += 1
+        return rank
+
+    @staticmethod
+    def unrankCombination (rank, k):
+        """ The k positions, largest first, of a colex rank """
+        positions = []
+        while k > 0:
+            # Largest r with choose (r, k) <= rank
+            lo = k - 1
+            hi = k
+            while HandIndexer.choose (hi, k) <= rank:
+                lo = hi
+                hi *= 2
+            while hi - lo > 1:
+                mid = (lo + hi) / 2
+                if HandIndexer.choose (mid, k) <= rank:
+                    lo = mid
+                else:
+                    hi = mid
+            positions.append (lo)
+            rank -= HandIndexer.choose (lo, k)
+            k -= 1
+        return positions
+
+    @staticmethod
+    def unrankSet (rank, k):
+        """ The set of k ranks of a colex rank """
+        bits = 0
+        for r in HandIndexer.unrankCombination (rank, k):
+            bits |= 1 << r
+        return bits
+
+    @staticmethod
+    def squeeze (bits, used):
+        """ Renumbers the ranks of bits leaving out the ranks in used """
+        out = 0
+        shift = 0
+        for r in range (0, 13):
+            if used & (1 << r):
+                continue
+            if bits & (1 << r):
+                out |= 1 << shift
+            shift += 1
+        return out
+
+    @staticmethod
+    def expand (bits, used):
+        """ Inverse of squeeze """
+        out = 0
+        shift = 0
+        for r in range (0, 13):
+            if used & (1 << r):
+                continue
+            if bits & (1 << shift):
+                out |= 1 << r
+            shift += 1
+        return out
+
+    def size (self):
+        return self._size
+
+    def indexMasks (self, holeMask, boardMask):
+        suits = []
+        for shift in HandIndexer.SHIFTS:
+            hole = (holeMask >> shift) & 0x1FFF
+            board = (boardMask >> shift) & 0x1FFF
+            config = HandIndexer.rankSet (hole) * \
+                HandIndexer.choose (13 - Evaluate.noOfRanks [hole],
+                    Evaluate.noOfRanks [board]) + \
+                HandIndexer.rankSet (HandIndexer.squeeze (board, hole))
+            suits.append ((Evaluate.noOfRanks [hole],
+                Evaluate.noOfRanks [board], config))
+        suits.sort (reverse = True)
+        n = self._patternIndex [tuple ([(h, b) for h, b, c in suits])]
+        index = 0
+        first = 0
+        for counts, m, configs, groupSize in self._groups [n]:
+            # Multiset of m configurations as an m combination
+            rank = 0
+            for i in range (0, m):
+                rank += HandIndexer.choose (suits [first + i][2] + m - 1 - i,
+                    m - i)
+            index = index * groupSize + rank
+            first += m
+        return self._offsets [n] + index
+
+    def index (self, hand, table):
+        return self.indexMasks (hand._hexValue, table._hexValue)
+
+    def unrank (self, index):
+        """ Returns the (hole mask, board mask) of a canonical situation """
+        n = bisect.bisect_right (self._offsets, index) - 1
+        index -= self._offsets [n]
+        ranks = []
+        for counts, m, configs, groupSize in reversed (self._groups [n]):
+            ranks.append (index % groupSize)
+            index /= groupSize
+        ranks.reverse ()
+
+        holeMask = 0
+        boardMask = 0
+        suit = 0
+        for (counts, m, configs, groupSize), rank in zip (self._groups [n],
+                ranks):
+            boardConfigs = HandIndexer.choose (13 - counts [0], counts [1])
+            # The m combination back to the multiset, largest first
+            values = [w - (m - 1 - i) for i, w in
+                enumerate (HandIndexer.unrankCombination (rank, m))]
+            for config in values:
+                hole = HandIndexer.unrankSet (config / boardConfigs,
+                    counts [0])
+                board = HandIndexer.expand (HandIndexer.unrankSet (
+                    config % boardConfigs, counts [1]), hole)
+                holeMask |= hole << HandIndexer.SHIFTS [suit]
+                boardMask |= board << HandIndexer.SHIFTS [suit]
+                suit += 1
+        return holeMask, boardMask
+
+
+class PreflopTable (object):
+    """
+    Preflop equity of every starting hand against 1 to MAX_OPPONENTS random
+    hands, generated offline by gentables.py --preflop.
+
+    Hands that only differ by a permutation of the suits have the same
+    equity; the preflop HandIndexer numbers the 16432 classes of the 270725
+    holdings, and the table is indexed by it.  Equities are stored as 16 bit
+    fractions of SCALE, followed by the canonical hand of every class (see
+    HandIndexer.unrank) as its four 16 bit suit fields.  The header records
+    the boards dealt, the mean number of runouts per class and the mean and
+    largest standard errors of the equities, in fractions of SCALE.
+
+    For an OpponentRange the table also has the heads up equities of every
+    class against the hands of each of BUCKETS strength buckets (the
+    deciles of OpponentRange.strengths), after the holes.  A ranged spot is
+    the mean of those, weighted by the weight of the hands of the range in
+    each bucket that miss our hand; how the weights vary within a bucket is
+    left out.
+    """
+
+    TABLE_FILE = os.path.join (os.path.dirname (os.path.abspath (__file__)),
+        'preflop.tbl')
+    MAGIC = 'PFT5'
+    HEADER = struct.Struct ('<iiiiHHiiH')
+    MAX_OPPONENTS = 3
+    SCALE = 65535
+    # Boards dealt by gentables.py --preflop: about 466000 runouts per
+    # class, standard errors of 0.1 percentage points (0.25 at most), an
+    # hour and a half on one core
+    BOARDS = 120000
+    # Hands of a class kept per board, see generate
+    KEEP = 6
+    # Shares of the boards the standard errors are estimated from
+    GROUPS = 16
+    # Strength buckets of the ranged equities and the boards they are
+    # dealt from, see generateRanges
+    BUCKETS = 10
+    RANGED_BOARDS = 60000
+
+    equities = []
+    holes = []
+    boards = 0
+    runouts = 0
+    standardErrors = (0, 0)
+    rangeEquities = []
+    rangedBoards = 0
+    rangeError = 0
+
+    @staticmethod
+    def drawDisjoint (pool, held, rng):
+        """
+        For every mask of held, the index of a random holding of pool that
+        misses it
+        """
+        picks = rng.randint (0, len (pool), len (held))
+        redo = numpy.nonzero (pool.take (picks) & held) [0]
+        while len (redo) > 0:
+            picks [redo] = rng.randint (0, len (pool), len (redo))
+            redo = redo [(pool.take (picks [redo]) & held.take (redo)) != 0]
+        return picks
+
+    @staticmethod
+    def generate (boards, log = None):
+        """
+        Monte Carlo over shared boards, needs numpy.  Every board dealt is
+        scored for all the live holdings at once, through the strengths of
+        its couples as in BoardTable, and the holdings kept are matched
+        against MAX_OPPONENTS holdings dealt from the other live ones.  A
+        holding is kept with probability KEEP / size of its class, so every
+        class gets about the same number of runouts per board.  The
+        runouts of a board are correlated, the standard errors come from the
+        spread between GROUPS interleaved shares of the boards.
+        """
+        indexer = HandIndexer.get (0)
+        holes = []
+        for n in range (0, indexer.size ()):
+            mask, board = indexer.unrank (n)
+            for shift in HandIndexer.SHIFTS:
+                holes.append ((mask >> shift) & 0xFFFF)
+        hands, sizes = OpponentRange.classHands (holes)
+        holdings, classes = OpponentRange.listHoldings (hands)
+        couples = BatchEvaluate.holdingCouples (holdings)
+        noOfClasses = len (sizes)
+        deck = BatchEvaluate.deck
+        keep = numpy.minimum (1.0,
+            float (PreflopTable.KEEP) / sizes) [classes]
+
+        opponents = PreflopTable.MAX_OPPONENTS
+        groups = PreflopTable.GROUPS
+        wins = numpy.zeros ((groups, opponents, noOfClasses))
+        done = numpy.zeros ((groups, noOfClasses))
+        rng = BatchEvaluate.randomState ()
+        for b in range (0, boards):
+            board = deck [rng.choice (len (deck), 5, replace = False)]
+            dead = numpy.bitwise_or.reduce (board)
+            scores = BatchEvaluate.holdingScores (
+                BatchEvaluate.coupleStrengths (board), couples)
+            live = numpy.nonzero ((holdings & dead) == 0) [0]
+            pool = holdings.take (live)
+            poolScores = scores.take (live)
+            kept = live [rng.random_sample (len (live)) < keep.take (live)]
+            held = holdings.take (kept)
+            myScores = scores.take (kept)
+            Iwin = numpy.ones (len (kept), dtype = bool)
+            firsts = numpy.zeros (len (kept), dtype = numpy.int8)
+            for p in range (0, opponents):
+                picks = PreflopTable.drawDisjoint (pool, held, rng)
+                held = held | pool.take (picks)
+                Iwin &= poolScores.take (picks) <= myScores
+                firsts += Iwin
+            keptClasses = classes.take (kept)
+            for p in range (0, opponents):
+                wins [b % groups, p] += numpy.bincount (keptClasses,
+                    weights = firsts > p, minlength = noOfClasses)
+            done [b % groups] += numpy.bincount (keptClasses,
+                minlength = noOfClasses)
+            if log != None and b % 5000 == 0:
+                log ("%d / %d" % (b, boards))
+
+        done = numpy.maximum (done, 1)
+        means = wins.sum (axis = 0) / done.sum (axis = 0)
+        errors = (wins / done [:, None, :]).std (axis = 0, ddof = 1) / \
+            math.sqrt (groups)
+        PreflopTable.equities = [int (x) for x in numpy.round (
+            means.T.ravel () * PreflopTable.SCALE)]
+        PreflopTable.holes = holes
+        PreflopTable.boards = boards
+        PreflopTable.runouts = int (round (done.sum () / noOfClasses))
+        PreflopTable.standardErrors = (
+            int (round (errors.mean () * PreflopTable.SCALE)),
+            int (round (errors.max () * PreflopTable.SCALE)))
+
+    @staticmethod
+    def generateRanges (boards, log = None):
+        """
+        The equities against every strength bucket, from the equities of
+        generate.  The same Monte Carlo over shared boards as generate, heads
+        up, every holding kept is matched against BUCKETS holdings dealt
+        from all the live ones and the runouts are split by the bucket of
+        the opponent.  A bucket then counts as often as its hands are live
+        on the boards dealt, so the mean of the buckets weighted by their
+        live hands is the equity against random hands.
+        """
+        OpponentRange.initialize ()
+        holdings = OpponentRange.holdings
+        classes = OpponentRange.holdingClasses
+        couples = OpponentRange.holdingCouples
+        holdingBuckets = OpponentRange.buckets.take (classes)
+        sizes = OpponentRange.sizes
+        noOfClasses = len (sizes)
+        deck = BatchEvaluate.deck
+        keep = numpy.minimum (1.0,
+            float (PreflopTable.KEEP) / sizes) [classes]
+
+        buckets = PreflopTable.BUCKETS
+        groups = PreflopTable.GROUPS
+        cells = noOfClasses * buckets
+        wins = numpy.zeros ((groups, cells))
+        done = numpy.zeros ((groups, cells))
+        rng = BatchEvaluate.randomState ()
+        for b in range (0, boards):
+            board = deck [rng.choice (len (deck), 5, replace = False)]
+            dead = numpy.bitwise_or.reduce (board)
+            scores = BatchEvaluate.holdingScores (
+                BatchEvaluate.coupleStrengths (board), couples)
+            live = numpy.nonzero ((holdings & dead) == 0) [0]
+            pool = holdings.take (live)
+            poolScores = scores.take (live)
+            poolBuckets = holdingBuckets.take (live)
+            kept = live [rng.random_sample (len (live)) < keep.take (live)]
+            held = holdings.take (kept)
+            myScores = scores.take (kept)
+            keptCells = classes.take (kept) * buckets
+            for k in range (0, buckets):
+                picks = PreflopTable.drawDisjoint (pool, held, rng)
+                cell = keptCells + poolBuckets.take (picks)
+                wins [b % groups] += numpy.bincount (cell,
+                    weights = poolScores.take (picks) <= myScores,
+                    minlength = cells)
+                done [b % groups] += numpy.bincount (cell, minlength = cells)
+            if log != None and b % 5000 == 0:
+                log ("%d / %d" % (b, boards))
+
+        means = wins.sum (axis = 0) / numpy.maximum (done.sum (axis = 0), 1)
+        errors = (wins / numpy.maximum (done, 1)).std (axis = 0, ddof = 1) / \
+            math.sqrt (groups)
+        PreflopTable.rangeEquities = [int (x) for x in numpy.round (
+            means * PreflopTable.SCALE)]
+        PreflopTable.rangedBoards = boards
+        PreflopTable.rangeError = int (round (errors.mean () *
+            PreflopTable.SCALE))
+
+    @staticmethod
+    def save (path = None):
+        if path == None:
+            path = PreflopTable.TABLE_FILE
+        fp = open (path, 'wb')
+        fp.write (PreflopTable.MAGIC)
+        fp.write (PreflopTable.HEADER.pack (HandIndexer.get (0).size (),
+            PreflopTable.MAX_OPPONENTS, PreflopTable.boards,
+            PreflopTable.runouts, PreflopTable.standardErrors [0],
+            PreflopTable.standardErrors [1],
+            len (PreflopTable.rangeEquities) / HandIndexer.get (0).size (),
+            PreflopTable.rangedBoards, PreflopTable.rangeError))
+        array ('H', PreflopTable.equities).tofile (fp)
+        array ('H', PreflopTable.holes).tofile (fp)
+        array ('H', PreflopTable.rangeEquities).tofile (fp)
+        fp.close ()
+
+    @staticmethod
+    def load (path = None):
+        """ Loads the table, returns False if there is no usable file """
+        if path == None:
+            path = PreflopTable.TABLE_FILE
+        try:
+            fp = open (path, 'rb')
+        except IOError:
+            return False
+        try:
+            if fp.read (4) != PreflopTable.MAGIC:
+                return False
+            noOfClasses, maxOpponents, boards, runouts, meanError, \
+                maxError, buckets, rangedBoards, rangeError = \
+                PreflopTable.HEADER.unpack (fp.read (PreflopTable.HEADER.size))
+            if noOfClasses != HandIndexer.get (0).size () or \
+               buckets not in (0, PreflopTable.BUCKETS):
+                return False
+            equities = array ('H')
+            equities.fromfile (fp, noOfClasses * maxOpponents)
+            holes = array ('H')
+            holes.fromfile (fp, noOfClasses * 4)
+            rangeEquities = array ('H')
+            rangeEquities.fromfile (fp, noOfClasses * buckets)
+        except (EOFError, struct.error):
+            return False
+        finally:
+            fp.close ()
+
+        PreflopTable.MAX_OPPONENTS = maxOpponents
+        PreflopTable.equities = equities
+        PreflopTable.holes = holes
+        PreflopTable.boards = boards
+        PreflopTable.runouts = runouts
+        PreflopTable.standardErrors = (meanError, maxError)
+        PreflopTable.rangeEquities = rangeEquities
+        PreflopTable.rangedBoards = rangedBoards
+        PreflopTable.rangeError = rangeError
+        return True
+
+    @staticmethod
+    def getProbability (hand, no_of_players, weights = None):
+        """
+        Win probability in percent, as calcProbabilities with an empty
+        table would estimate it, or None if it is not in the table.
+        weights are the class weights of an OpponentRange, heads up only.
+        """
+        if no_of_players > PreflopTable.MAX_OPPONENTS or \
+           hand.getNumberOfCards () != 4 or len (PreflopTable.equities) == 0:
+            return None
+        n = HandIndexer.get (0).indexMasks (hand._hexValue, 0)
+        if weights is None:
+            return PreflopTable.equities [n * PreflopTable.MAX_OPPONENTS +
+                no_of_players - 1] * 100.0 / PreflopTable.SCALE
+        if no_of_players != 1 or len (PreflopTable.rangeEquities) == 0:
+            return None
+        buckets = PreflopTable.BUCKETS
+        # Every hand of a class is under 24 / size of the permutations
+        live = ((OpponentRange.hands & hand._hexValue) == 0).sum (axis = 1)
+        bucketWeights = numpy.bincount (OpponentRange.buckets,
+            weights = weights * live, minlength = buckets)
+        equities = numpy.array (PreflopTable.rangeEquities [n * buckets:
+            (n + 1) * buckets], dtype = numpy.float64)
+        return (bucketWeights * equities).sum () / bucketWeights.sum () * \
+            100.0 / PreflopTable.SCALE
+
+class AliasTable (object):
+    """
+    Draws index i with probability weights [i] / sum (weights) in O(1): a
+    uniform column and a biased coin choosing between the column and its
+    alias (Walker's alias method).  Needs numpy.
+
+    The table is built by sweeping (Huebschle-Schneider and Sanders): the
+    light items (below the mean) and the heavy ones are taken in order, a
+    light item is filled by the heavy one in use and a heavy one that gets
+    light is filled by the next.  Which heavy item is in use only depends
+    on the cumulative deficits of the light items and the cumulative
+    excesses of the heavy ones, so the sweep is two searchsorted.
+    """
+
+    def __init__ (self, weights):
+        n = len (weights)
+        scaled = weights * (n / float (weights.sum ()))
+        light = numpy.flatnonzero (scaled < 1.0)
+        heavy = numpy.flatnonzero (scaled >= 1.0)
+        deficits = numpy.concatenate (([0.0],
+            numpy.cumsum (1.0 - scaled [light])))
+        excesses = numpy.cumsum (scaled [heavy] - 1.0)
+        prob = numpy.ones (n)
+        alias = numpy.arange (n)
+
+        # A light item is filled by the first heavy one with excess left
+        using = numpy.searchsorted (excesses, deficits [:-1], 'right')
+        prob [light] = scaled [light]
+        alias [light] = heavy [numpy.minimum (using, len (heavy) - 1)]
+
+        # A heavy item gets light with the first light item that takes its
+        # cumulative excess, the next heavy one fills what it is missing;
+        # the ones never used up are full up to rounding errors
+        usedUp = numpy.searchsorted (deficits, excesses [:-1], 'left')
+        h = numpy.flatnonzero (usedUp < len (deficits))
+        prob [heavy [h]] = 1.0 + excesses [h] - deficits [usedUp [h]]
+        alias [heavy [h]] = heavy [h + 1]
+
+        self._prob = numpy.clip (prob, 0.0, 1.0)
+        self._alias = alias
+
+    def draw (self, n, rng):
+        """ n indexes, rng is a numpy RandomState """
+        columns = rng.randint (0, len (self._prob), n)
+        coins = rng.random_sample (n)
+        return numpy.where (coins < self._prob [columns], columns,
+            self._alias [columns])
+
+
+class OpponentRange (object):
+    """
+    What the opponent's actions in the current hand tell about its hole
+    cards: a weight for every preflop class (see PreflopTable), the same
+    for every hand of the class.  The range starts uniform and every action
+    multiplies the weights by the likelihood of the action for the strength
+    of the class, its heads up preflop equity as a percentile of the 270725
+    hands.  After the flop the preflop strength is only a proxy; the floors
+    of the likelihoods keep every hand possible.
+
+    The hands are drawn by a RangeSampler of the spot.  Needs numpy and the
+    preflop table.
+    """
+
+    # Likelihood of an action for a hand of strength s (0 to 1), as
+    # (floor, exponent, aggressive): floor + (1 - floor) * s ** exponent
+    # for the aggressive actions, the same with 1 - s for the passive ones.
+    # A check tells next to nothing (it is free and strong hands slow play
+    # it) and would take the spot off the cache and the exact paths, so it
+    # keeps the range as it is.
+    ACTIONS = {
+        'raise': (0.1, 2.0, True),
+        'call': (0.3, 1.0, True)}
+
+    PERMUTATIONS = list (itertools.permutations (range (0, 4)))
+
+    # Built on first use and shared by every range: the hand masks of
+    # every class under the 24 suit permutations, the number of different
+    # hands of every class, their strengths and their PreflopTable strength
+    # buckets; every different hand once with its class and the numbers of
+    # its couples (see ExactEquity.weightedCounts)
+    hands = []
+    sizes = []
+    strengths = []
+    buckets = []
+    holdings = []
+    holdingClasses = []
+    holdingCouples = []
+
+    # The last range rebuilt by replay
+    replayed = None
+
+    @staticmethod
+    def available ():
+        return BatchEvaluate.available () and len (PreflopTable.holes) > 0
+
+    @staticmethod
+    def classHands (holes):
+        """
+        The hand masks of every class of holes (four suit fields per class,
+        as in PreflopTable.holes) under the 24 suit permutations, and the
+        number of different hands of every class
+        """
+        holes = numpy.array (holes, dtype = numpy.int64).reshape (-1, 4)
+        hands = numpy.zeros ((len (holes), len (OpponentRange.PERMUTATIONS)),
+            dtype = numpy.int64)
+        for p, permutation in enumerate (OpponentRange.PERMUTATIONS):
+            for s in range (0, 4):
+                hands [:, p] |= holes [:, s] << HandIndexer.SHIFTS [
+                    permutation [s]]
+        ordered = numpy.sort (hands, axis = 1)
+        sizes = 1 + (ordered [:, 1:] != ordered [:, :-1]).sum (axis = 1)
+        return hands, sizes
+
+    @staticmethod
+    def listHoldings (hands):
+        """
+        Every different hand of the classHands hands once, in an array, and
+        the array of their classes
+        """
+        ordered = numpy.sort (hands, axis = 1)
+        isFirst = numpy.ones (ordered.shape, dtype = bool)
+        isFirst [:, 1:] = ordered [:, 1:] != ordered [:, :-1]
+        return ordered [isFirst], numpy.nonzero (isFirst) [0]
+
+    @staticmethod
+    def initialize ():
+        hands, sizes = OpponentRange.classHands (PreflopTable.holes)
+        equities = numpy.array (PreflopTable.equities [
+            0::PreflopTable.MAX_OPPONENTS], dtype = numpy.float64)
+        order = numpy.argsort (equities, kind = 'mergesort')
+        below = numpy.cumsum (sizes [order]) - sizes [order] / 2.0
+        strengths = numpy.empty (len (sizes))
+        strengths [order] = below / sizes.sum ()
+        holdings, classes = OpponentRange.listHoldings (hands)
+
+        OpponentRange.hands = hands
+        OpponentRange.sizes = sizes
+        OpponentRange.strengths = strengths
+        OpponentRange.buckets = numpy.minimum ((strengths *
+            PreflopTable.BUCKETS).astype (numpy.int64),
+            PreflopTable.BUCKETS - 1)
+        OpponentRange.holdings = holdings
+        OpponentRange.holdingClasses = classes
+        OpponentRange.holdingCouples = BatchEvaluate.holdingCouples (holdings)
+
+    @staticmethod
+    def replay (signature):
+        """
+        The range after the actions of signature, as the pool workers
+        rebuild it; the last one is kept for the next shares of the spot
+        """
+        replayed = OpponentRange.replayed
+        if replayed == None or replayed.getSignature () != signature:
+            replayed = OpponentRange ()
+            for action in signature:
+                replayed.update (action)
+            OpponentRange.replayed = replayed
+        return replayed
+
+    def __init__ (self):
+        self._weights = None
+        self._actions = []
+        self._samplers = {}
+
+    def isUniform (self):
+        return len (self._actions) == 0
+
+    def getSignature (self):
+        """ The same for ranges with the same weights """
+        return tuple (self._actions)
+
+    def getWeights (self):
+        """ The weights of the classes, None while the range is uniform """
+        return self._weights
+
+    def update (self, action):
+        """ Weighs the range by an action of the opponent """
+        if action not in OpponentRange.ACTIONS or \
+           not OpponentRange.available ():
+            return
+        if len (OpponentRange.strengths) == 0:
+            OpponentRange.initialize ()
+        floor, exponent, aggressive = OpponentRange.ACTIONS [action]
+        strengths = OpponentRange.strengths
+        if not aggressive:
+            strengths = 1.0 - strengths
+        likelihood = floor + (1.0 - floor) * strengths ** exponent
+        if len (self._actions) == 0:
+            self._weights = likelihood
+        else:
+            weights = self._weights * likelihood
+            self._weights = weights / weights.max ()
+        self._actions.append (action)
+        self._samplers = {}
+
+    def sampler (self, dead):
+        """
+        The RangeSampler of the spot where the cards of the dead mask are
+        out, None while the range is uniform.  Only the one of the last
+        spot is kept.
+        """
+        if len (self._actions) == 0:
+            return None
+        if dead not in self._samplers:
+            self._samplers = {dead: RangeSampler (self._weights, dead,
+                self.getSignature ())}
+        return self._samplers [dead]
+
+
+class RangeSampler (object):
+    """
+    Draws hands from the weights of an OpponentRange without the dead
+    cards of a spot, in O(1) per hand and without rejections: an
+    AliasTable picks the class, weighted by its number of live hands, then
+    one of the suit permutations of the class that miss the dead cards is
+    picked uniformly.  Every hand of a class comes from the same number of
+    permutations, so the hands of a class stay equally likely.
+
+    The signature of the range goes with the sampler, so the pool workers
+    can rebuild it (see parallelWorker).
+    """
+
+    def __init__ (self, weights, dead, signature = ()):
+        hands = OpponentRange.hands
+        compatible = (hands & dead) == 0
+        counts = compatible.sum (axis = 1)
+        # A class of size hands has each of them under 24 / size of the
+        # permutations, its live hands are counts * size / 24
+        self._alias = AliasTable (weights * counts * OpponentRange.sizes)
+        # The compatible permutations of every class first
+        self._order = numpy.argsort (~compatible, axis = 1,
+            kind = 'mergesort')
+        self._counts = counts
+        self._signature = signature
+
+    def draw (self, n, rng):
+        """
+        n hands: an (n, 4) array of card masks and the array of the hand
+        masks
+        """
+        classes = self._alias.draw (n, rng)
+        picks = (rng.random_sample (n) *
+            self._counts [classes]).astype (numpy.int64)
+        masks = OpponentRange.hands [classes, self._order [classes, picks]]
+        cards = numpy.empty ((n, 4), dtype = numpy.int64)
+        rest = masks.copy ()
+        for i in range (0, 4):
+            low = rest & -rest
+            cards [:, i] = low
+            rest ^= low
+        return cards, masks
+
+
+class EquityCache (object):
+    """
+    Bounded LRU cache of win probabilities, keyed by the suit isomorphic
+    situation (HandIndexer index and board size), the number of opponents
+    and the signature of the opponent's range.
+
+    Recent results live in an OrderedDict capped by MAX_BYTES.  Results of
+    earlier matches are in a file of sorted fixed size records, memory
+    mapped at start up and binary searched in place; hits found there are
+    promoted to the LRU.  save merges both back, the in memory entries
+    first, up to MAX_FILE_ENTRIES records.
+    """
+
+    CACHE_FILE = os.path.join (os.path.dirname (os.path.abspath (__file__)),
+        'equity.cache')
+    MAGIC = 'EQC1'
+    HEADER = struct.Struct ('<4sI')
+    RECORD = struct.Struct ('<QH')
+
+    # Memory cap of the in memory part, an entry costs about ENTRY_BYTES
+    MAX_BYTES = 16 * 1024 * 1024
+    ENTRY_BYTES = 200
+    MAX_FILE_ENTRIES = 1000000
+    # Probabilities are stored in hundredths of percent
+    SCALE = 100.0
+    # The signature of the range is coded above the 41 bits of the rest of
+    # the key (35 for the index of a river spot), an action per base
+    # len (OpponentRange.ACTIONS) + 1 digit
+    RANGE_SHIFT = 41
+
+    def __init__ (self, path = None, maxBytes = None):
+        if path == None:
+            path = EquityCache.CACHE_FILE
+        if maxBytes == None:
+            maxBytes = EquityCache.MAX_BYTES
+        self._path = path
+        self._maxEntries = maxBytes / EquityCache.ENTRY_BYTES
+        self._entries = collections.OrderedDict ()
+        self._hits = 0
+        self._misses = 0
+        self._file = None
+        self._mapped = None
+        self._noOfMapped = 0
+
+    @staticmethod
+    def makeKey (hand, table, no_of_players, signature = ()):
+        """
+        The key of a spot against the range of signature (see
+        OpponentRange.getSignature), None if the signature is too long to
+        be coded in a key
+        """
+        n = table.getNumberOfCards ()
+        index = HandIndexer.get (n).index (hand, table)
+        actions = sorted (OpponentRange.ACTIONS)
+        code = 0
+        for action in signature:
+            code = code * (len (actions) + 1) + actions.index (action) + 1
+        if code >> (64 - EquityCache.RANGE_SHIFT) != 0:
+            return None
+        return code << EquityCache.RANGE_SHIFT | index << 6 | n << 3 | \
+            min (no_of_players, 7)
+
+    def open (self):
+        """ Maps the file of a previous run, if there is one """
+        try:
+            self._file = open (self._path, 'rb')
+            self._mapped = mmap.mmap (self._file.fileno (), 0,
+                access = mmap.ACCESS_READ)
+            magic, count = EquityCache.HEADER.unpack_from (self._mapped, 0)
+        except (IOError, OSError, ValueError, struct.error):
+            self.close ()
+            return False
+        if magic != EquityCache.MAGIC or len (self._mapped) != \
+           EquityCache.HEADER.size + count * EquityCache.RECORD.size:
+            self.close ()
+            return False
+        self._noOfMapped = count
+        return True
+
+    def close (self):
+        if self._mapped != None:
+            self._mapped.close ()
+        if self._file != None:
+            self._file.close ()
+        self._mapped = None
+        self._file = None
+        self._noOfMapped = 0
+
+    def findMapped (self, key):
+        lo = 0
+        hi = self._noOfMapped
+        while lo < hi:
+            mid = (lo + hi) / 2
+            k, value = EquityCache.RECORD.unpack_from (self._mapped,
+                EquityCache.HEADER.size + mid * EquityCache.RECORD.size)
+            if k < key:
+                lo = mid + 1
+            elif k > key:
+                hi = mid
+            else:
+                return value
+        return None
+
+    def contains (self, key):
+        """ True if key is cached, without counting a hit or a miss """
+        if key == None:
+            return False
+        return key in self._entries or \
+            (self._mapped != None and self.findMapped (key) != None)
+
+    def lookup (self, key):
+        """ The cached probability in percent, or None """
+        if key == None:
+            self._misses += 1
+            return None
+        value = self._entries.pop (key, None)
+        if value == None and self._mapped != None:
+            value = self.findMapped (key)
+        if value == None:
+            self._misses += 1
+            return None
+        self._hits += 1
+        self._entries [key] = value
+        self.trim ()
+        return value / EquityCache.SCALE
+
+    def store (self, key, prob):
+        if key == None:
+            return
+        self._entries.pop (key, None)
+        self._entries [key] = int (round (prob * EquityCache.SCALE))
+        self.trim ()
+
+    def trim (self):
+        while len (self._entries) > self._maxEntries:
+            self._entries.popitem (last = False)
+
+    def getStats (self):
+        """ (hits, misses, entries in memory, entries in the file) """
+        return self._hits, self._misses, len (self._entries), \
+            self._noOfMapped
+
+    def save (self):
+        records = dict (self._entries)
+        for n in range (0, self._noOfMapped):
+            if len (records) >= EquityCache.MAX_FILE_ENTRIES:
+                break
+            k, value = EquityCache.RECORD.unpack_from (self._mapped,
+                EquityCache.HEADER.size + n * EquityCache.RECORD.size)
+            if k not in records:
+                records [k] = value
+        keys = sorted (records)
+
+        tmpPath = self._path + '.tmp'
+        fp = open (tmpPath, 'wb')
+        fp.write (EquityCache.HEADER.pack (EquityCache.MAGIC, len (keys)))
+        for k in keys:
+            fp.write (EquityCache.RECORD.pack (k, records [k]))
+        fp.close ()
+        self.close ()
+        os.rename (tmpPath, self._path)
+        self.open ()
+
+LookupEvaluate.initialize ()
+BatchEvaluate.initialize ()
+PreflopTable.load ()
 
 class BelongTrapezoid (object):
     def __init__ (self, name, x0, x1, x2, x3, y):
@@ -635,6 +3267,24 @@ class TriangleVar (FuzzyVar):
         self._x1 = x1
         self._x2 = x2
 
+    def getParameters (self):
+        return (self._x0, self._x1, self._x2)
+
+    def belongArray (self, xs):
+        """ belong over a numpy array of values """
+        with numpy.errstate (divide = 'ignore', invalid = 'ignore'):
+            return numpy.select ([
+                (self._x0 == self._x1) & (xs == self._x0),
+                (self._x1 == self._x2) & (xs == self._x1),
+                xs < self._x0,
+                xs <= self._x1,
+                xs <= self._x2], [
+                1.0,
+                1.0,
+                0.0,
+                (xs - self._x0) / (self._x1 - self._x0),
+                (self._x2 - xs) / (self._x2 - self._x1)], 0.0)
+
     def belong (self, x):
         if self._x0 == self._x1 and x == self._x0:
             value = 1.0
@@ -684,6 +3334,28 @@ class Trapezoid (FuzzyVar):
         self._x2 = x2
         self._x3 = x3
 
+    def getParameters (self):
+        return (self._x0, self._x1, self._x2, self._x3)
+
+    def belongArray (self, xs):
+        """ belong over a numpy array of values """
+        with numpy.errstate (divide = 'ignore', invalid = 'ignore'):
+            return numpy.select ([
+                (self._x0 == self._x1) & (xs == self._x0),
+                (self._x1 == self._x2) & (xs == self._x1),
+                (self._x2 == self._x3) & (xs == self._x2),
+                xs <= self._x0,
+                xs <= self._x1,
+                xs <= self._x2,
+                xs <= self._x3], [
+                1.0,
+                1.0,
+                1.0,
+                0.0,
+                (xs - self._x0) / (self._x1 - self._x0),
+                1.0,
+                (self._x3 - xs) / (self._x3 - self._x2)], 0.0)
+
     def belong (self, x):
         if self._x0 == self._x1 and x == self._x0:
             value = 1.0
@@ -733,6 +3405,11 @@ class inputSet (object):
     def addValue (self, FV):
         self._input.append (FV)
 
+    def getSignature (self):
+        """ The membership parameters, see ActionCalculator.compile """
+        return tuple ([(i.getName (), i.__class__.__name__,
+            i.getParameters ()) for i in self._input])
+
     def getValues (self, val):
         values = {}
         for i in self._input:
@@ -741,6 +3418,13 @@ class inputSet (object):
 
         return values
 
+    def getValuesArray (self, vals):
+        """ getValues over a numpy array, the values are arrays """
+        values = {}
+        for i in self._input:
+            values [i.getName ()] = i.belongArray (vals)
+        return values
+
 class outputSet (object):
     """ If we want a discrete output. """
     def __init__ (self, name, out_range):
@@ -752,6 +3436,16 @@ class outputSet (object):
     def addValue (self, name, value):
         self._output.append ((name, value))
 
+    def getSignature (self):
+        return (self._out_range, tuple (self._output))
+
+    def getCuts (self):
+        """ The values halfway between two outputs, where getClosestValue
+        changes """
+        values = sorted ([o [1] for o in self._output])
+        return [(values [i] + values [i + 1]) / 2.0
+            for i in range (0, len (values) - 1)]
+
     def getClosestValue (self, value):
         closestVal = 10000000000.0
         closestName = None
@@ -793,6 +3487,42 @@ class outputSet (object):
 
         return R.getCentroid ()
 
+    def getCentroidArray (self, values_dict):
+        """
+        getCentroid over arrays of set values, with the arithmetic of
+        BelongTrapezoid and ResultSet on arrays so the results are the
+        same.  Points where every value is 0 get nan.
+        """
+        totalArea = 0.0
+        centroid = 0.0
+        with numpy.errstate (divide = 'ignore', invalid = 'ignore'):
+            for s in self._sets:
+                if s.getName () not in values_dict:
+                    continue
+                y = values_dict [s.getName ()]
+                x0, x1, x3 = s.getParameters ()
+                # The trapezoid of getBelongTrapezoidY
+                t1 = y * (x1 - x0) + x0
+                t2 = x3 - (y * (x3 - x1))
+                a1 = (t1 - x0) * y / 2.0
+                a2 = (t2 - t1) * y
+                a3 = (x3 - t2) * y / 2.0
+                c = (x0 + t1 + t1) * a1 / 3.0
+                c += (t1 + t2) * a2 / 2.0
+                c += (t2 + t2 + x3) * a3 / 3.0
+                a = a1 + a2 + a3
+                c = numpy.where (a > 0, c / a, c)
+                centroid += a * c
+                totalArea += a
+            return centroid / totalArea
+
+    def getClosestValues (self, values):
+        """ getClosestValue over an array, returns an array of names """
+        names = numpy.array ([o [0] for o in self._output], dtype = object)
+        targets = numpy.array ([o [1] for o in self._output])
+        return names [numpy.abs (values [:, numpy.newaxis] - targets).argmin (
+            axis = 1)]
+
 class ResultSet (object):
     def __init__ (self):
         self._results = []
@@ -813,6 +3543,168 @@ class ResultSet (object):
         centroid /= totalArea
         return centroid
             
+class SurfaceCell (object):
+    """ A cell of a DecisionSurface with the values at its corners """
+    __slots__ = ('_x0', '_x1', '_y0', '_y1', '_values', '_depth',
+        '_children', '_exact')
+
+    def __init__ (self, x0, x1, y0, y1, depth):
+        self._x0 = x0
+        self._x1 = x1
+        self._y0 = y0
+        self._y1 = y1
+        # Corners (x0, y0), (x1, y0), (x0, y1), (x1, y1)
+        self._values = None
+        self._depth = depth
+        self._children = None
+        # The queries of the cell are left to the function
+        self._exact = False
+
+    def interpolate (self, x, y):
+        tx = (x - self._x0) / (self._x1 - self._x0)
+        ty = (y - self._y0) / (self._y1 - self._y0)
+        v = self._values
+        return (v [0] + (v [1] - v [0]) * tx) * (1.0 - ty) + \
+            (v [2] + (v [3] - v [2]) * tx) * ty
+
+
+class DecisionSurface (object):
+    """
+    A function of two variables, such as a fuzzy inference, compiled into
+    a grid of cells interpolated bilinearly from the exact values at their
+    corners.
+
+    The grid is built at once, a level at a time with one call of the
+    function over arrays: every cell is compared with the function on a
+    CHECKS x CHECKS lattice that includes its edges, and is split in four
+    if the interpolation is off by more than half the tolerance anywhere,
+    down to MAX_DEPTH.  A cell whose corner values come within the
+    tolerance of one of the cuts, the values where what the caller makes
+    of the result changes, is split down to CUT_DEPTH only.  Cells still
+    off, or still near a cut, are left to the function: value returns None
+    there, as it does outside the box, and the caller runs the function.
+    Elsewhere a query costs a few comparisons and one interpolation.
+    """
+
+    TOLERANCE = 0.01
+    MAX_DEPTH = 4
+    CUT_DEPTH = 2
+    CHECKS = 4
+
+    def __init__ (self, function, xs, ys, cuts = (), tolerance = None):
+        """
+        function maps arrays of x and y to the array of their values, xs
+        and ys are the sorted lines of the starting grid; needs numpy
+        """
+        if tolerance == None:
+            tolerance = DecisionSurface.TOLERANCE
+        self._function = function
+        self._tolerance = tolerance
+        self._cuts = cuts
+        self._xs = xs
+        self._ys = ys
+        self._cells = []
+        cells = []
+        for i in range (0, len (xs) - 1):
+            row = []
+            for j in range (0, len (ys) - 1):
+                row.append (SurfaceCell (xs [i], xs [i + 1], ys [j],
+                    ys [j + 1], 0))
+            self._cells.append (row)
+            cells.extend (row)
+        while len (cells) > 0:
+            cells = self.refine (cells)
+
+    def refine (self, cells):
+        """
+        Sets the corner values of cells, returns their children where they
+        must be split
+        """
+        t = numpy.linspace (0.0, 1.0, DecisionSurface.CHECKS)
+        x0 = numpy.array ([cell._x0 for cell in cells])
+        x1 = numpy.array ([cell._x1 for cell in cells])
+        y0 = numpy.array ([cell._y0 for cell in cells])
+        y1 = numpy.array ([cell._y1 for cell in cells])
+        xs = x0 [:, None, None] + (x1 - x0) [:, None, None] * t [:, None]
+        ys = y0 [:, None, None] + (y1 - y0) [:, None, None] * t
+        xs, ys = numpy.broadcast_arrays (xs, ys)
+        values = self._function (xs.ravel (), ys.ravel ()).reshape (xs.shape)
+
+        corners = numpy.stack ([values [:, 0, 0], values [:, -1, 0],
+            values [:, 0, -1], values [:, -1, -1]], axis = 1)
+        tx = t [:, None]
+        interpolated = (corners [:, 0, None, None] + (corners [:, 1] -
+            corners [:, 0]) [:, None, None] * tx) * (1.0 - t) + \
+            (corners [:, 2, None, None] + (corners [:, 3] -
+            corners [:, 2]) [:, None, None] * tx) * t
+        with numpy.errstate (invalid = 'ignore'):
+            errors = numpy.abs (values - interpolated).reshape (
+                len (cells), -1)
+            off = ~(errors <= self._tolerance / 2.0).all (axis = 1)
+            low = corners.min (axis = 1) - self._tolerance
+            high = corners.max (axis = 1) + self._tolerance
+            nearCut = numpy.zeros (len (cells), dtype = bool)
+            for cut in self._cuts:
+                nearCut |= (low <= cut) & (cut <= high)
+
+        children = []
+        for cell, values, near, bad in zip (cells, corners.tolist (),
+                nearCut.tolist (), off.tolist ()):
+            cell._values = values
+            if near:
+                depth = DecisionSurface.CUT_DEPTH
+            elif bad:
+                depth = DecisionSurface.MAX_DEPTH
+            else:
+                continue
+            if cell._depth >= depth:
+                cell._exact = True
+                continue
+            xm = (cell._x0 + cell._x1) / 2.0
+            ym = (cell._y0 + cell._y1) / 2.0
+            depth = cell._depth + 1
+            cell._children = [
+                SurfaceCell (cell._x0, xm, cell._y0, ym, depth),
+                SurfaceCell (xm, cell._x1, cell._y0, ym, depth),
+                SurfaceCell (cell._x0, xm, ym, cell._y1, depth),
+                SurfaceCell (xm, cell._x1, ym, cell._y1, depth)]
+            children.extend (cell._children)
+        return children
+
+    def value (self, x, y):
+        xs = self._xs
+        ys = self._ys
+        if x < xs [0] or x > xs [-1] or y < ys [0] or y > ys [-1]:
+            return None
+        i = min (bisect.bisect_right (xs, x), len (xs) - 1) - 1
+        j = min (bisect.bisect_right (ys, y), len (ys) - 1) - 1
+        cell = self._cells [i][j]
+        while cell._children != None:
+            index = 0
+            if x >= cell._children [0]._x1:
+                index += 1
+            if y >= cell._children [0]._y1:
+                index += 2
+            cell = cell._children [index]
+        if cell._exact:
+            return None
+        return cell.interpolate (x, y)
+
+    def getStats (self):
+        """ (cells, cells left to the function) """
+        count = 0
+        exact = 0
+        stack = [cell for row in self._cells for cell in row]
+        while len (stack) > 0:
+            cell = stack.pop ()
+            count += 1
+            if cell._exact:
+                exact += 1
+            if cell._children != None:
+                stack.extend (cell._children)
+        return count, exact
+
+
 class GameTypeCalculator:
     def __init__ (self, initial_pot):
 
@@ -834,6 +3726,11 @@ class GameTypeCalculator:
         self._O.proccessSets ()
 
     def calculateGameType (self, chips):
+        # The bot plays AGGRESIVE whatever the chips, see inferGameType
+        return 2.0, 'AGGRESIVE'
+
+    def inferGameType (self, chips):
+        """ The fuzzy game type, not used by calculateGameType yet """
         ci = self._CI.getValues (chips)
 
         todo = {}
@@ -847,9 +3744,7 @@ class GameTypeCalculator:
             FuzzyOperators.op_not (ci['AVERAGE']))
         todo ['CONSERVATIVE'] = val 
         c = self._O.getCentroid (todo)
-
-        return 2.0, 'AGGRESIVE'
-#return c, self._O.getClosestValue (c)
+        return c, self._O.getClosestValue (c)
 
 class ActionCalculator (object):
     RAISE_MAX_VALUE  = 5.0
@@ -864,6 +3759,49 @@ class ActionCalculator (object):
     CALL_NAME = "CALL"
     FOLD_NAME = "FOLD"
 
+    # The rules, as (action, game type set, hand set): the action gets
+    # the AND of the two sets, or the game type set alone when the hand
+    # set is None, and the values of an action add up
+    RULES = [
+        (RAISE_MAX_NAME, 'SUICIDAL', None),
+
+        (RAISE_MAX_NAME, 'AGGRESIVE', 'VERY GOOD'),
+        (RAISE_MED_NAME, 'AGGRESIVE', 'GOOD'),
+        (CALL_NAME, 'AGGRESIVE', 'REGULAR'),
+        (FOLD_NAME, 'AGGRESIVE', 'BAD'),
+
+        (RAISE_MED_NAME, 'CAUTIOUS', 'VERY GOOD'),
+        (RAISE_MIN_NAME, 'CAUTIOUS', 'GOOD'),
+        (CALL_NAME, 'CAUTIOUS', 'REGULAR'),
+        (FOLD_NAME, 'CAUTIOUS', 'BAD'),
+
+        (RAISE_MIN_NAME, 'CONSERVATIVE', 'VERY GOOD'),
+        (CALL_NAME, 'CONSERVATIVE', 'GOOD'),
+        (FOLD_NAME, 'CONSERVATIVE', 'REGULAR'),
+        (FOLD_NAME, 'CONSERVATIVE', 'BAD')]
+
+    # Resolution of the hand probability scan in getBoundaries
+    BOUNDARY_STEP = 0.25
+
+    # Box of the compiled decision surface, the inference is undefined
+    # for game types where no game type set applies (0 and 5)
+    SURFACE_GAME_TYPES = [1.0, 1.5, 2.0, 2.5, 3.0, 3.5, 4.0]
+    SURFACE_HAND_PROBS = [i * 5.0 for i in range (0, 21)]
+
+    # The calculators by class, built on first use and shared by every Bot,
+    # and their DecisionSurfaces by signature
+    calculators = {}
+    surfaces = {}
+
+    @staticmethod
+    def get (calculatorClass):
+        """ The shared instance of calculatorClass """
+        calculator = ActionCalculator.calculators.get (calculatorClass)
+        if calculator == None:
+            calculator = calculatorClass ()
+            ActionCalculator.calculators [calculatorClass] = calculator
+        return calculator
+
     def __init__ (self):
         self._O = outputSet ("ACTION", (0.0, 6.0))
         self._O.addValue ("FOLD", ActionCalculator.FOLD_VALUE)
@@ -879,46 +3817,103 @@ class ActionCalculator (object):
         self._GT.addValue (TriangleVar ("CAUTIOUS", 2.0, 3.0, 4.0))
         self._GT.addValue (TriangleVar ("CONSERVATIVE", 3.0, 4.0, 5.0))
 
+        self._boundaries = {}
+        self._surface = None
+        self._signature = None
+
+    def getSignature (self):
+        return (self._GT.getSignature (), self._Hand.getSignature (),
+            self._O.getSignature (), tuple (self.RULES))
+
+    def compile (self):
+        """
+        Compiles infer into a DecisionSurface, again only if the membership
+        parameters changed since the last compile; calculators with the same
+        signature share it.  Without numpy there is no surface and
+        applyRules runs infer.
+        """
+        signature = self.getSignature ()
+        if signature != self._signature:
+            self._surface = None
+            if numpy != None:
+                if signature not in ActionCalculator.surfaces:
+                    ActionCalculator.surfaces [signature] = DecisionSurface (
+                        self.centroidArray,
+                        ActionCalculator.SURFACE_GAME_TYPES,
+                        ActionCalculator.SURFACE_HAND_PROBS,
+                        self._O.getCuts ())
+                self._surface = ActionCalculator.surfaces [signature]
+            self._signature = signature
+            self._boundaries = {}
+        return self._surface
+
+    def getBoundaries (self, game_type):
+        """ Hand probabilities where the action name changes, cached """
+        if game_type not in self._boundaries:
+            step = ActionCalculator.BOUNDARY_STEP
+            probs = [i * step for i in range (0, int (100.0 / step) + 1)]
+            if numpy != None:
+                names = self.inferArray ([game_type] * len (probs), probs) [1]
+            else:
+                names = [self.applyRules (game_type, p) [1] for p in probs]
+            bounds = []
+            prevName = None
+            for i, name in enumerate (names):
+                if prevName != None and name != prevName:
+                    bounds.append ((i - 0.5) * step)
+                prevName = name
+            self._boundaries [game_type] = bounds
+        return self._boundaries [game_type]
+
     def applyRules (self, game_type, hand_prob):
-        todo = {}
+        Log.debug ("hand_prob %s, game_type %s", hand_prob, game_type)
+        if self._signature == None:
+            self.compile ()
+        c = None
+        if self._surface != None:
+            c = self._surface.value (game_type, hand_prob)
+        if c == None:
+            c = self.infer (game_type, hand_prob)
+        return c, self._O.getClosestValue (c)
+
+    def infer (self, game_type, hand_prob):
+        """ The centroid of the fuzzy inference """
         gt = self._GT.getValues (game_type)
         hp = self._Hand.getValues (hand_prob)
 
-        Bot.writeMsg ("hand_prob " + str(hand_prob) + ", game_type " + \
-                str(game_type))
-        Bot.writeMsg ("applyRules " + str(hp))
-
-        todo['RAISE MAX' ] = gt ['SUICIDAL']
-
-        todo['RAISE MAX' ] += FuzzyOperators.op_and (gt['AGGRESIVE'],
-                hp ['VERY GOOD'])
-        todo['RAISE MED' ] = FuzzyOperators.op_and (gt['AGGRESIVE'],
-                hp ['GOOD'])
-        todo['CALL' ] = FuzzyOperators.op_and (gt['AGGRESIVE'], 
-                hp ['REGULAR'])
-        todo['FOLD' ] = FuzzyOperators.op_and (gt['AGGRESIVE'], 
-                hp ['BAD'])
-
-        todo['RAISE MED' ] += FuzzyOperators.op_and (gt['CAUTIOUS'],
-                hp ['VERY GOOD'])
-        todo['RAISE MIN' ] = FuzzyOperators.op_and (gt['CAUTIOUS'],
-                hp ['GOOD'])
-        todo['CALL' ] += FuzzyOperators.op_and (gt['CAUTIOUS'], 
-                hp ['REGULAR'])
-        todo['FOLD' ] += FuzzyOperators.op_and (gt['CAUTIOUS'], 
-                hp ['BAD'])
-
-        todo['RAISE MIN' ] += FuzzyOperators.op_and (gt['CONSERVATIVE'],
-                hp ['VERY GOOD'])
-        todo['CALL' ] += FuzzyOperators.op_and (gt['CONSERVATIVE'],
-                hp ['GOOD'])
-        todo['FOLD' ] += FuzzyOperators.op_and (gt['CONSERVATIVE'], 
-                hp ['REGULAR'])
-        todo['FOLD' ] += FuzzyOperators.op_and (gt['CONSERVATIVE'], 
-                hp ['BAD'])
+        todo = {}
+        for action, gtName, hpName in self.RULES:
+            if hpName == None:
+                val = gt [gtName]
+            else:
+                val = FuzzyOperators.op_and (gt [gtName], hp [hpName])
+            todo [action] = todo.get (action, 0.0) + val
+
+        return self._O.getCentroid (todo)
 
-        c = self._O.getCentroid (todo)
-        return c, self._O.getClosestValue (c)
+    def inferArray (self, game_types, hand_probs):
+        """
+        infer over numpy arrays of points, for sweeps over many points;
+        needs numpy.  Returns the centroids and the action names
+        """
+        c = self.centroidArray (game_types, hand_probs)
+        return c, self._O.getClosestValues (c)
+
+    def centroidArray (self, game_types, hand_probs):
+        """ The centroids of inferArray """
+        gt = self._GT.getValuesArray (numpy.asarray (game_types, dtype = float))
+        hp = self._Hand.getValuesArray (numpy.asarray (hand_probs,
+            dtype = float))
+
+        todo = {}
+        for action, gtName, hpName in self.RULES:
+            if hpName == None:
+                val = gt [gtName]
+            else:
+                val = numpy.minimum (gt [gtName], hp [hpName])
+            todo [action] = todo.get (action, 0.0) + val
+
+        return self._O.getCentroidArray (todo)
 
 class ActionCalculatorPreFlop (ActionCalculator):
     def __init__ (self):
@@ -974,7 +3969,7 @@ class PlayerInfo (object):
         elif settings[0] == 'hand':
             self._hand = Hand ()
             self._hand.parseHand (settings[1])
-            Bot.writeMsg ("Hand " + str(self._hand))
+            Log.debug ("Hand %s", self._hand)
 
     def getStack (self):
         return self._stack
@@ -984,21 +3979,47 @@ class PlayerInfo (object):
 
 
 class Bot (object):
+    # Iterations of the first round of the pure Python evaluator
     ITERATIONS = 200
-    def __init__ (self):
-        self._ACPF = ActionCalculatorPreFlop ()
-        self._ACF = ActionCalculatorFlop ()
-        self._ACT = ActionCalculatorTurn ()
-        self._ACR = ActionCalculatorRiver ()
+    # Upper bound when the numpy batch evaluator is available, the run is
+    # cut by the deadline
+    BATCH_ITERATIONS = 100000
+    # Upper bound for the pure Python evaluator
+    MAX_ITERATIONS = 20000
+    # Share of the time of a move given to calcProbabilities
+    TIME_FRACTION = 0.5
+    # Deal the next spot while waiting for the Action line
+    PONDER = True
+    def __init__ (self, out = None, cache = None):
+        """
+        out is the stream the actions are written to, sys.stdout by
+        default; cache the EquityCache, by default the one of the
+        equity.cache file
+        """
+        if out == None:
+            out = sys.stdout
+        if cache == None:
+            cache = EquityCache ()
+            cache.open ()
+        self._out = out
+        self._playerInfo = PlayerInfo ()
+        self._otherInfo = PlayerInfo ()
+        self._range = OpponentRange ()
+        # HandStatistics of the last calcProbabilities, None when the
+        # probability came from a table or the cache
+        self._stats = None
         self._GT = None
-
-    @staticmethod
-    def writeMsg (msg):
-#fp = open ("perro.txt", "a+")
-#        fp.write (str(datetime.datetime.now()) + " " + msg + "\n")
-#        fp.flush ()
-#        fp.close ()
-        pass
+        self._cache = cache
+        self._samples = None
+        self._ponderer = None
+        self._timePerMove = 0
+        self._decisions = 0
+        self._timer = None
+        self._parseTime = 0.0
+        # The decision surfaces are built before the first decision
+        for calculatorClass in (ActionCalculatorPreFlop, ActionCalculatorFlop,
+                ActionCalculatorTurn, ActionCalculatorRiver):
+            ActionCalculator.get (calculatorClass).compile ()
 
     def parseSettings (self, settings):   
         if settings[0] == 'timeBank':
@@ -1012,12 +4033,15 @@ class Bot (object):
             self._GT = GameTypeCalculator (self._startingStack)
         elif settings[0] == 'yourBot':
             self._yourBot = settings[1]
-            Bot.writeMsg ("yourBot " +  self._yourBot)
+            Log.info ("yourBot %s", self._yourBot)
 
 
     def parseMatch (self, settings):
         if settings[0] == 'round':
+            self.stopPondering ()
             self._round = int (settings[1])
+            self._range = OpponentRange ()
+            self._stats = None
             self._table = None
             self._preFlop = False
             self._flop = False
@@ -1031,19 +4055,21 @@ class Bot (object):
             self._hasButton = False
             if settings [1] == self._yourBot:
                 self._hasButton = True
-            Bot.writeMsg ("Has button " +  str(self._hasButton))
+            Log.debug ("Has button %s", self._hasButton)
         elif settings[0] == 'maxWinPot':
             self._maxWinPot = int (settings[1])
-            Bot.writeMsg ("Max win pot " +  str(self._maxWinPot))
+            Log.debug ("Max win pot %d", self._maxWinPot)
         elif settings[0] == 'amountToCall':
             self._ammountToCall = int (settings[1])
-            Bot.writeMsg ("Ammount to call " +  str(self._ammountToCall))
+            Log.debug ("Ammount to call %d", self._ammountToCall)
         elif settings[0] == 'table':
             self._table = Hand ()
             self._table.parseHand (settings[1])
-            Bot.writeMsg ("Table " + str(self._table))
+            Log.debug ("Table %s", self._table)
+            self.startPondering ()
 
     def doPlay (self, value, name):
+        start = time.time ()
         minRaise = self._bigBlind
         maxRaise = self._maxWinPot
 
@@ -1052,7 +4078,7 @@ class Bot (object):
            name != ActionCalculator.CALL_NAME and \
            name != ActionCalculator.FOLD_NAME:
            if maxRaise > (10 * minRaise):
-               Bot.writeMsg ("Capping to CALL")
+               Log.info ("Capping to CALL")
                name = ActionCalculator.CALL_NAME
                value = ActionCalculator.CALL_VALUE
 
@@ -1066,89 +4092,243 @@ class Bot (object):
                     + minRaise + self._ammountToCall
                 r = int(r)
 
-                sys.stdout.write ("raise " + str(r) + "\n");
+                self._out.write ("raise " + str(r) + "\n");
             elif self._ammountToCall > 0:
-                sys.stdout.write ("call " + str(self._ammountToCall) + "\n");
+                self._out.write ("call " + str(self._ammountToCall) + "\n");
             else:
-                sys.stdout.write ("check 0\n");
+                self._out.write ("check 0\n");
         elif name == ActionCalculator.RAISE_MIN_NAME:
             if self._raises == 0:
                 self._raises += 1
                 r = self._ammountToCall + minRaise
-                sys.stdout.write ("raise " + str(r) + "\n");
+                self._out.write ("raise " + str(r) + "\n");
             elif self._ammountToCall > 0:
-                sys.stdout.write ("call " + str(self._ammountToCall) + "\n");
+                self._out.write ("call " + str(self._ammountToCall) + "\n");
             else:
-                sys.stdout.write ("check 0\n");
+                self._out.write ("check 0\n");
         elif name == ActionCalculator.CALL_NAME or\
              name == ActionCalculator.FOLD_NAME:
-            Bot.writeMsg ("HH CALL or FOLD " + str(value) + " max " + str(maxRaise) + " amount " + str(self._ammountToCall))
+            Log.debug ("HH CALL or FOLD %s max %s amount %s", value, maxRaise,
+                self._ammountToCall)
             if self._ammountToCall > 0:
                 x = (value - ActionCalculator.FOLD_VALUE) * maxRaise /\
                     (ActionCalculator.CALL_VALUE - ActionCalculator.FOLD_VALUE)
 
                 if x >= self._ammountToCall:
-                    sys.stdout.write ("call " + str(self._ammountToCall) + "\n");
+                    self._out.write ("call " + str(self._ammountToCall) + "\n");
                 else:
-                    sys.stdout.write ("fold 0\n");
+                    self._out.write ("fold 0\n");
             else:
-                sys.stdout.write ("check 0\n");
-        sys.stdout.flush ()
+                self._out.write ("check 0\n");
+        self._out.flush ()
+        if self._timer != None:
+            self._timer.add ('output', time.time () - start)
+
+    def getDeadline (self):
+        budget = min (self._timePerMove, self._actionTime) * Bot.TIME_FRACTION
+        return self._actionStart + budget / 1000.0
+
+    def getOpponents (self, table):
+        """
+        The RangeSampler of the opponent's range for the spot, None while
+        the range is uniform.  The cache keys, ExactEquity and the preflop
+        table take the range too.
+        """
+        return self._range.sampler (self._playerInfo.getHand ()._hexValue |
+            table._hexValue)
+
+    def calcProbabilities (self, table, no_of_players, calculator):
+        start = time.time ()
+        timer = self._timer
+        hand = self._playerInfo.getHand ()
+        opponents = self.getOpponents (table)
+        signature = self._range.getSignature ()
+        weights = self._range.getWeights ()
+        self._stats = None
+        key = EquityCache.makeKey (hand, table, no_of_players, signature)
+        prob = self._cache.lookup (key)
+        if prob != None:
+            if timer != None:
+                timer.set ('source', 'cache')
+                timer.add ('equity', time.time () - start)
+            return prob
+        deadline = self.getDeadline ()
+        if ExactEquity.fits (table, no_of_players, deadline - time.time (),
+                weights is not None):
+            wins, ties, losses = ExactEquity.counts (hand, table, weights)
+            prob = ExactEquity.calcProbabilities (hand, table,
+                (wins, ties, losses))
+            self._stats = HandStatistics (wins + ties + losses, wins + ties,
+                ties)
+            if timer != None:
+                timer.set ('source', 'exact')
+        else:
+            if BatchEvaluate.available ():
+                minIterations = BatchEvaluate.CHUNK
+                maxIterations = Bot.BATCH_ITERATIONS
+            else:
+                minIterations = Bot.ITERATIONS
+                maxIterations = Bot.MAX_ITERATIONS
+            self.prepareSamples (hand, table, no_of_players)
+            boundaries = calculator.getBoundaries (self._game_type)
+            reused = len (self._samples)
+            runStart = time.time ()
+            wins, done = AnytimeEquity.countWinsByPlayers (hand, table,
+                no_of_players, boundaries, deadline, minIterations,
+                maxIterations, self._samples, opponents)
+            if timer != None:
+                seconds = max (time.time () - runStart, 1e-9)
+                timer.set ('source', 'montecarlo')
+                timer.set ('deals', done)
+                timer.set ('reused', reused)
+                timer.set ('dealsPerSecond', (done - reused) / seconds)
+                timer.set ('evaluationsPerSecond',
+                    (done - reused) * (no_of_players + 1) / seconds)
+            self._stats = self._samples.statistics ()
+            # The same pass gives the spots with fewer opponents
+            for p in range (0, no_of_players - 1):
+                self._cache.store (EquityCache.makeKey (hand, table, p + 1,
+                    signature), (wins [p] * 100) / done)
+            prob = (wins [-1] * 100) / done
+        self._cache.store (key, prob)
+        if self._stats != None:
+            Log.info ("Statistics %s", self._stats)
+        if timer != None:
+            timer.set ('range', signature)
+            timer.add ('equity', time.time () - start)
+        return prob
+
+    def applyRules (self, calculator):
+        """ The action of calculator for the game type and probability """
+        start = time.time ()
+        value, name = calculator.applyRules (self._game_type,
+            float (self._prob))
+        if self._timer != None:
+            self._timer.add ('rules', time.time () - start)
+        return value, name
+
+    def prepareSamples (self, hand, table, no_of_players):
+        """
+        Keeps the deals of the previous streets of the hand (or of the
+        pondering) that are still deals of this spot
+        """
+        signature = self._range.getSignature ()
+        if self._samples != None and \
+           self._samples.matches (hand, table, no_of_players, signature):
+            self._samples.advance (table)
+        else:
+            self._samples = StreetSamples (hand, table, no_of_players,
+                signature)
+
+    def startPondering (self):
+        """
+        Starts dealing the spot of the next decision, if it will be run by
+        AnytimeEquity
+        """
+        self.stopPondering ()
+        if not Bot.PONDER:
+            return
+        hand = self._playerInfo.getHand ()
+        weights = self._range.getWeights ()
+        if self._table == None:
+            if PreflopTable.getProbability (hand, 1, weights) != None:
+                return
+            table = Hand ()
+        else:
+            table = self._table
+        key = EquityCache.makeKey (hand, table, 1,
+            self._range.getSignature ())
+        if self._cache.contains (key) or ExactEquity.fits (table, 1,
+                self._timePerMove * Bot.TIME_FRACTION / 1000.0,
+                weights is not None):
+            return
+        if BatchEvaluate.available ():
+            step = Ponderer.BATCH_STEP
+            maxIterations = Bot.BATCH_ITERATIONS
+        else:
+            step = Ponderer.SCALAR_STEP
+            maxIterations = Bot.MAX_ITERATIONS
+        self.prepareSamples (hand, table, 1)
+        self._ponderer = Ponderer (hand.clone (), table.clone (), 1,
+            self._samples, step, maxIterations, self.getOpponents (table))
+        self._ponderer.start ()
+
+    def stopPondering (self):
+        if self._ponderer != None:
+            self._ponderer.stop ()
+            self._ponderer = None
+            Log.debug ("pondered %d", len (self._samples))
+
+    def saveCache (self):
+        try:
+            self._cache.save ()
+        except (IOError, OSError), e:
+            sys.stderr.write ("equity cache not saved: " + str (e) + "\n")
+        Log.info ("cache hits %d misses %d entries %d mapped %d",
+            *self._cache.getStats ())
 
     def doPreFlop (self):
+        calculator = ActionCalculator.get (ActionCalculatorPreFlop)
         if not self._preFlop:
             self._preFlop = True
             self._raises = 0
             if self._GT == None:
                 self._GT = GameTypeCalculator (self._playerInfo.getStack())
             self._game_type, dummy = self._GT.calculateGameType (self._playerInfo.getStack ())
-            self._prob = Evaluate.calcProbabilities (
-                    self._playerInfo.getHand(), Hand(), 1, Bot.ITERATIONS)
-
-        Bot.writeMsg ("GT " + str(self._game_type) + " prob " + str(self._prob))
-        value, name = self._ACPF.applyRules (self._game_type, float(self._prob))
+            self._prob = PreflopTable.getProbability (
+                self._playerInfo.getHand (), 1, self._range.getWeights ())
+            if self._prob == None:
+                self._prob = self.calcProbabilities (Hand (), 1, calculator)
+            elif self._timer != None:
+                self._timer.set ('source', 'preflop')
+
+        Log.info ("GT %s prob %s", self._game_type, self._prob)
+        value, name = self.applyRules (calculator)
         self.doPlay (value, name)
 
     def doFlop (self):
-        Bot.writeMsg ("doFlop ")
+        Log.debug ("doFlop")
+        calculator = ActionCalculator.get (ActionCalculatorFlop)
         if not self._flop:
             self._flop = True
             self._raises = 0
             self._game_type, dummy = self._GT.calculateGameType (self._playerInfo.getStack ())
-            self._prob = Evaluate.calcProbabilities (
-                    self._playerInfo.getHand(), self._table, 1, Bot.ITERATIONS)
+            self._prob = self.calcProbabilities (self._table, 1,
+                calculator)
 
-        value, name = self._ACF.applyRules (self._game_type, float(self._prob))
+        value, name = self.applyRules (calculator)
         self.doPlay (value, name)
 
 
     def doTurn (self):
-        Bot.writeMsg ("doTurn ")
+        Log.debug ("doTurn")
+        calculator = ActionCalculator.get (ActionCalculatorTurn)
         if not self._turn:
             self._turn = True
             self._raises = 0
             self._game_type, dummy = self._GT.calculateGameType (self._playerInfo.getStack ())
-            self._prob = Evaluate.calcProbabilities (
-                    self._playerInfo.getHand(), self._table, 1, Bot.ITERATIONS)
+            self._prob = self.calcProbabilities (self._table, 1,
+                calculator)
 
-        value, name = self._ACT.applyRules (self._game_type, float(self._prob))
+        value, name = self.applyRules (calculator)
         self.doPlay (value, name)
 
 
     def doRiver (self):
-        Bot.writeMsg ("doRiver ")
+        Log.debug ("doRiver")
+        calculator = ActionCalculator.get (ActionCalculatorRiver)
         if not self._river:
             self._river = True
             self._raises = 0
             self._game_type, dummy = self._GT.calculateGameType (self._playerInfo.getStack ())
-            self._prob = Evaluate.calcProbabilities (
-                    self._playerInfo.getHand(), self._table, 1, Bot.ITERATIONS)
+            self._prob = self.calcProbabilities (self._table, 1,
+                calculator)
 
-        value, name = self._ACR.applyRules (self._game_type, float(self._prob))
+        value, name = self.applyRules (calculator)
         self.doPlay (value, name)
 
     def doAction (self):
-        Bot.writeMsg ("doAction")
+        Log.debug ("doAction")
         if (self._table == None ):
             self.doPreFlop ()
         elif (self._table.getNumberOfCards () == 3):
@@ -1160,53 +4340,106 @@ class Bot (object):
 
     def parseAction (self, settings):
         if settings[0] == self._yourBot:
+            self._actionStart = time.time ()
+            self._decisions += 1
+            street = 0
+            if self._table != None:
+                street = self._table.getNumberOfCards ()
+            if DecisionTimer.stream != None:
+                self._timer = DecisionTimer (self._decisions, street,
+                    self._actionStart)
+                self._timer.add ('parse', self._parseTime)
+            self._parseTime = 0.0
+            profile = DecisionProfiler.start (self._decisions, street)
+
+            self.stopPondering ()
+            if self._timer != None:
+                self._timer.add ('ponder', time.time () - self._actionStart)
             self._actionTime = int (settings[1])
-            Bot.writeMsg ("Player action " +  str(self._actionTime))
+            Log.debug ("Player action %d", self._actionTime)
             self.doAction ()
+
+            if profile != None:
+                DecisionProfiler.stop (profile, self._decisions)
+            if self._timer != None:
+                self._timer.write ()
+                self._timer = None
             
     def parseYourBot (self, settings):
         self._playerInfo.parseLine (settings)
+        if settings [0] == 'hand':
+            self.startPondering ()
 
     def parseOtherBot (self, settings):
         self._otherInfo.parseLine (settings)
-
-    def run (self):
-        self._playerInfo = PlayerInfo ()
-        self._otherInfo = PlayerInfo ()
-        while not sys.stdin.closed:
+        if settings[0] in OpponentRange.ACTIONS:
+            self._range.update (settings[0])
+            Log.debug ("Opponent range %s", self._range.getSignature ())
+            # What was pondered is for the range before the action
+            if not self._range.isUniform ():
+                self.startPondering ()
+
+    def processLine (self, line):
+        """ Handles one line of the engine """
+        Log.debug ("%s", line)
+
+        parts = line.split ()
+
+        if len (parts) == 0:
+            return
+        if parts[0] == 'Action':
+            self.parseAction (parts[1:])
+            return
+
+        start = time.time ()
+        if parts[0] == 'Settings':
+            self.parseSettings (parts[1:])
+        elif parts[0] == 'Match':
+            self.parseMatch (parts[1:])
+        elif parts[0] == self._yourBot:
+            self.parseYourBot (parts[1:])
+        else:
+            self.parseOtherBot (parts[1:])
+        self._parseTime += time.time () - start
+
+    def run (self, stream = None):
+        """ Plays the lines of stream, sys.stdin by default """
+        if stream == None:
+            stream = sys.stdin
+        while not stream.closed:
             try:
-                rawline = sys.stdin.readline ()
+                rawline = stream.readline ()
 
                 if len (rawline) == 0:
                     break
 
-                line = rawline.strip ()
-                    
-                Bot.writeMsg (line)
-
-                parts = line.split ()
-
-                if parts[0] == 'Settings':
-                    self.parseSettings (parts[1:])
-                elif parts[0] == 'Match':
-                    self.parseMatch (parts[1:])
-                elif parts[0] == 'Action':
-                    self.parseAction (parts[1:])
-                elif parts[0] == self._yourBot:
-                    self.parseYourBot (parts[1:])
-                else:
-                    self.parseOtherBot (parts[1:])
+                self.processLine (rawline.strip ())
 
             except EOFError:
                 return
             except Exception, e:
                 exc_type, exc_value, exc_traceback = sys.exc_info()
-                Bot.writeMsg ( str(e))
-                Bot.writeMsg ( repr(traceback.extract_tb(exc_traceback)) )
+                Log.error ("%s %r", e, traceback.extract_tb (exc_traceback))
                 sys.stderr.write (str(e))
                 sys.stderr.write ( repr(traceback.extract_tb(exc_traceback)) )
                 return  
 
 if __name__ == '__main__':
+    if 'OMAHA_SEED' in os.environ:
+        Random.seed (int (os.environ ['OMAHA_SEED']))
+    if 'OMAHA_TIMING' in os.environ:
+        DecisionTimer.open (os.environ ['OMAHA_TIMING'])
+    if 'OMAHA_PROFILE' in os.environ:
+        DecisionProfiler.configure (os.environ ['OMAHA_PROFILE'],
+            os.environ.get ('OMAHA_PROFILE_DIR'))
+    if 'OMAHA_LOG' in os.environ:
+        Log.start (os.environ.get ('OMAHA_LOG_FILE'),
+            Log.LEVELS [os.environ ['OMAHA_LOG'].upper ()])
+    ParallelEvaluate.start ()
     B = Bot ()
+    Log.info ("ready in %.3fs", time.time () - STARTED)
     B.run ()
+    B.stopPondering ()
+    B.saveCache ()
+    ParallelEvaluate.stop ()
+    Log.stop ()
@@ -0,0 +1,255 @@
+#!/usr/bin/python
+"""
+Accuracy against cost of the equity estimators.
+
+A reference set of random spots is built for every street and every
+opponent sampler of SAMPLERS: random hands (Deck) and the range left by
+the actions of a signature (RangeSampler, needs numpy and the preflop
+table).  The references are exact from the flop on (ExactEquity, the flop
+summed over the turn cards, weighted by the range when there is one).
+Preflop they come from engines the estimators don't share: the preflop
+table for random hands, and against a range RANGED_REFERENCE_BOARDS
+random boards, each exact over the range.  Every estimator configuration
+(backend and iterations) is then run REPLICATES times on every spot with
+different seeds, and for every sampler and street the harness reports
+
+    bias        mean of estimate - reference, in percentage points
+    rmse        root mean square error, in percentage points
+    trunc       bias of the integer percent calcProbabilities returns
+    seconds     wall time of one estimate
+
+with the mean standard error of the references (0 when they are exact)
+and, from the rmse of the budgets (the error falls as
+1 / sqrt (iterations)), the iterations and seconds needed to reach each
+of the TARGETS.  The results are also written as JSON to
+accuracy_output.txt.
+
+Usage: python accuracy.py [spots [replicates]]
+"""
+
+import json
+import math
+import sys
+import time
+
+import Bot
+from Bot import BatchEvaluate, Evaluate, ExactEquity, Hand, OpponentRange, \
+    PreflopTable, Random
+
+OUTPUT_FILE = 'accuracy_output.txt'
+STREETS = (0, 3, 4, 5)
+# (name, signature of the opponent's range), () for random hands
+SAMPLERS = (('uniform', ()), ('raise', ('raise',)))
+# Error targets of the cost curves, in percentage points
+TARGETS = (5.0, 2.0, 1.0, 0.5)
+# Preflop against random hands without the preflop table
+SCALAR_REFERENCE_ITERATIONS = 200000
+# Preflop against a range: boards dealt, and the shares of them the
+# standard error is estimated from
+RANGED_REFERENCE_BOARDS = 10000
+REFERENCE_GROUPS = 10
+
+
+def scalarEstimator (hand, table, iterations, opponents):
+    wins, done = Evaluate.countWins (hand, table, 1, iterations)
+    return wins * 100.0 / done
+
+def batchEstimator (hand, table, iterations, opponents):
+    wins, done = BatchEvaluate.countWinsByPlayers (hand, table, 1,
+        iterations, None, None, opponents)
+    return wins [-1] * 100.0 / done
+
+def samplers ():
+    """ The SAMPLERS that can run here """
+    if OpponentRange.available ():
+        return SAMPLERS
+    return SAMPLERS [:1]
+
+def configurations (signature):
+    """
+    (backend name, estimator, iteration budgets) against the range of
+    signature; only the batch backend deals from a range
+    """
+    configs = []
+    if len (signature) == 0:
+        configs.append (('scalar', scalarEstimator,
+            [100, 200, 400, 800, 1600]))
+    if BatchEvaluate.available ():
+        configs.append (('batch', batchEstimator,
+            [1000, 2000, 4000, 8000, 16000]))
+    return configs
+
+def percent (wins, ties, losses):
+    return (wins + ties) * 100.0 / (wins + ties + losses)
+
+def exactReference (hand, table, weights):
+    """ Exact equity from the flop on, the flop summed over the turns """
+    if table.getNumberOfCards () >= 4:
+        return percent (*ExactEquity.counts (hand, table, weights))
+    wins = ties = losses = 0
+    dead = hand._hexValue | table._hexValue
+    T = table.clone ()
+    for c in Bot.Card.DECK:
+        if c._hexValue & dead != 0:
+            continue
+        T.truncate (table.getNumberOfCards ())
+        T.addCard (c)
+        w, t, l = ExactEquity.counts (hand, T, weights)
+        wins += w
+        ties += t
+        losses += l
+    return percent (wins, ties, losses)
+
+def rangedPreflopReference (hand, weights):
+    """
+    (equity, standard error) against a range: random boards, each exact
+    over the range.  The boards are summed, not averaged, so a board
+    counts for the weight of the range it leaves.
+    """
+    R = Random (0)
+    groups = REFERENCE_GROUPS
+    good = [0.0] * groups
+    total = [0.0] * groups
+    for b in range (0, RANGED_REFERENCE_BOARDS):
+        deck = Bot.Deck (hand._hexValue, R)
+        deck.shuffle (5)
+        table = Hand ()
+        for j in range (0, 5):
+            table.addCard (deck.deal ())
+        wins, ties, losses = ExactEquity.counts (hand, table, weights)
+        good [b % groups] += wins + ties
+        total [b % groups] += wins + ties + losses
+    shares = [g / t for g, t in zip (good, total)]
+    mean = sum (shares) / groups
+    variance = sum ([(x - mean) ** 2 for x in shares]) / (groups - 1)
+    return sum (good) * 100.0 / sum (total), \
+        math.sqrt (variance / groups) * 100.0
+
+def reference (hand, table, weights):
+    """
+    (equity, standard error) of the spot, weights are the class weights
+    of the opponent's range or None for random hands
+    """
+    if table.getNumberOfCards () == 0:
+        if weights is not None:
+            return rangedPreflopReference (hand, weights)
+        if len (PreflopTable.equities) > 0:
+            return PreflopTable.getProbability (hand, 1), \
+                PreflopTable.standardErrors [0] * 100.0 / PreflopTable.SCALE
+        Random.seed (0)
+        p = scalarEstimator (hand, table, SCALAR_REFERENCE_ITERATIONS, None)
+        return p, math.sqrt (p * (100 - p) / SCALAR_REFERENCE_ITERATIONS)
+    if weights is None and table.getNumberOfCards () == 3 and \
+       OpponentRange.available ():
+        # Every holding weighs the same, much faster than counting cliques
+        if len (OpponentRange.sizes) == 0:
+            OpponentRange.initialize ()
+        weights = Bot.numpy.ones (len (OpponentRange.sizes))
+    return exactReference (hand, table, weights), 0.0
+
+def referenceSpots (spots, seed, signature):
+    """
+    {board cards: [(hand, table, reference equity, standard error)]}
+    against the range of signature
+    """
+    weights = None
+    if len (signature) > 0:
+        weights = OpponentRange.replay (signature).getWeights ()
+    R = Random (seed)
+    result = {}
+    for boardCards in STREETS:
+        result [boardCards] = []
+        for i in range (0, spots):
+            deck = Bot.Deck (0, R)
+            deck.shuffle (4 + boardCards)
+            hand = Hand ()
+            table = Hand ()
+            for j in range (0, 4):
+                hand.addCard (deck.deal ())
+            for j in range (0, boardCards):
+                table.addCard (deck.deal ())
+            ref, error = reference (hand, table, weights)
+            result [boardCards].append ((hand, table, ref, error))
+    return result
+
+def measure (spots, estimator, iterations, replicates, signature):
+    """ (bias, rmse, truncated bias, seconds per estimate) """
+    errors = []
+    truncated = []
+    start = time.time ()
+    for n, (hand, table, ref, error) in enumerate (spots):
+        opponents = OpponentRange.replay (signature).sampler (
+            hand._hexValue | table._hexValue)
+        for r in range (0, replicates):
+            Random.seed (1000 * n + r + 1)
+            estimate = estimator (hand, table, iterations, opponents)
+            errors.append (estimate - ref)
+            truncated.append (int (estimate) - ref)
+    seconds = (time.time () - start) / len (errors)
+    bias = sum (errors) / len (errors)
+    rmse = math.sqrt (sum ([e * e for e in errors]) / len (errors))
+    return bias, rmse, sum (truncated) / len (truncated), seconds
+
+def main ():
+    spots = 10
+    replicates = 5
+    if len (sys.argv) > 1:
+        spots = int (sys.argv [1])
+    if len (sys.argv) > 2:
+        replicates = int (sys.argv [2])
+
+    results = []
+    for sampler, signature in samplers ():
+        start = time.time ()
+        reference = referenceSpots (spots, 1, signature)
+        print "%s reference set: %d spots per street, %.1fs" % (sampler,
+            spots, time.time () - start)
+        for boardCards in STREETS:
+            print "  %d board cards: standard error %.3f" % (boardCards,
+                sum ([s [3] for s in reference [boardCards]]) / spots)
+
+        for backend, estimator, budgets in configurations (signature):
+            for boardCards in STREETS:
+                results.append (measureStreet (sampler, signature, backend,
+                    estimator, budgets, boardCards, reference [boardCards],
+                    replicates))
+
+    fp = open (OUTPUT_FILE, 'w')
+    json.dump (results, fp, indent = 1, sort_keys = True)
+    fp.close ()
+
+def measureStreet (sampler, signature, backend, estimator, budgets,
+        boardCards, spots, replicates):
+    """ The rows and the cost curve of a configuration on a street """
+    print
+    print "%s, %s, %d board cards" % (sampler, backend, boardCards)
+    print "%10s %8s %8s %8s %10s" % ('iterations', 'bias', 'rmse',
+        'trunc', 'seconds')
+    rows = []
+    for iterations in budgets:
+        bias, rmse, trunc, seconds = measure (spots, estimator, iterations,
+            replicates, signature)
+        print "%10d %8.3f %8.3f %8.3f %10.5f" % (iterations, bias, rmse,
+            trunc, seconds)
+        rows.append ({'iterations': iterations, 'bias': bias, 'rmse': rmse,
+            'truncatedBias': trunc, 'seconds': seconds})
+
+    # rmse * sqrt (iterations), averaged over the budgets, and the time per
+    # iteration of the largest budget
+    spread = math.sqrt (sum ([r ['rmse'] ** 2 * r ['iterations']
+        for r in rows]) / len (rows))
+    perIteration = rows [-1]['seconds'] / rows [-1]['iterations']
+    curve = []
+    for target in TARGETS:
+        needed = int (math.ceil ((spread / target) ** 2))
+        curve.append ({'target': target, 'iterations': needed,
+            'seconds': needed * perIteration})
+        print "  %.1f points: %d iterations, %.4fs" % (target, needed,
+            needed * perIteration)
+    return {'sampler': sampler, 'signature': list (signature),
+        'backend': backend, 'boardCards': boardCards,
+        'referenceError': sum ([s [3] for s in spots]) / len (spots),
+        'rows': rows, 'curve': curve}
+
+if __name__ == '__main__':
+    main ()
@@ -0,0 +1,217 @@
+#!/usr/bin/python
+"""
+Benchmarks of the hot paths of Bot.py.
+
+Every benchmark gives the seconds per operation, the best of REPEATS runs
+with fixed seeds.  The results are written as JSON to bench_output.txt and
+compared with bench_baseline.json: a benchmark more than its threshold
+(a ratio, THRESHOLD by default) slower than the baseline is a regression
+and the exit status is 1.
+
+Usage: python bench.py                   run and compare
+       python bench.py --save-baseline   run and store the baseline
+       python bench.py name ...          only the benchmarks whose name
+                                         starts with one of the names
+"""
+
+import json
+import os
+import subprocess
+import sys
+import time
+
+import Bot
+from Bot import Evaluate, EquityCache, Hand, LookupEvaluate, Random
+from selfplay import Outbox
+
+OUTPUT_FILE = 'bench_output.txt'
+DIRECTORY = os.path.dirname (os.path.abspath (__file__))
+BASELINE_FILE = os.path.join (DIRECTORY, 'bench_baseline.json')
+REPEATS = 3
+THRESHOLD = 1.25
+
+# A heads up hand played to the river, the bot acting on every street
+TRANSCRIPT = """Settings timeBank 5000
+Settings timePerMove 500
+Settings handsPerLevel 10
+Settings startingStack 2000
+Settings yourBot player1
+Match round 1
+Match smallBlind 10
+Match bigBlind 20
+Match onButton player1
+player1 stack 2000
+player2 stack 2000
+player1 post 10
+player2 post 20
+player1 hand [Ah,Kd,7s,7c]
+Match maxWinPot 30
+Match amountToCall 10
+Action player1 5000
+player1 call 10
+player2 check 0
+Match table [2h,9h,Jc]
+Match maxWinPot 40
+Match amountToCall 0
+Action player1 5000
+Match table [2h,9h,Jc,7h]
+Match amountToCall 20
+Action player1 5000
+Match table [2h,9h,Jc,7h,Qd]
+Match amountToCall 0
+Action player1 5000"""
+
+
+def randomHands (n, sizes, seed):
+    """ n tuples of disjoint random Hands of the given sizes """
+    R = Random (seed)
+    result = []
+    for i in range (0, n):
+        deck = Bot.Deck (0, R)
+        deck.shuffle (sum (sizes))
+        hands = []
+        for size in sizes:
+            H = Hand ()
+            for j in range (0, size):
+                H.addCard (deck.deal ())
+            hands.append (H)
+        result.append (hands)
+    return result
+
+def timeIt (function, operations):
+    """ Best seconds per operation of REPEATS calls of function """
+    best = None
+    for r in range (0, REPEATS):
+        start = time.time ()
+        function ()
+        elapsed = (time.time () - start) / operations
+        if best == None or elapsed < best:
+            best = elapsed
+    return best
+
+def benchEval5 ():
+    masks = [h [0]._hexValue for h in randomHands (20000, [5], 1)]
+    def python ():
+        for m in masks:
+            Evaluate.eval5 (m)
+    def lookup ():
+        for m in masks:
+            LookupEvaluate.eval5 (m)
+    results = {'eval5.python': timeIt (python, len (masks))}
+    if LookupEvaluate.tableSize > 0:
+        results ['eval5.lookup'] = timeIt (lookup, len (masks))
+    return results
+
+def benchEval9cards ():
+    deals = randomHands (2000, [4, 5], 2)
+    def scalar ():
+        for hand, table in deals:
+            # A fresh board every time, as in the simulations
+            Evaluate.evalHand (hand, table.clone ())
+    return {'eval9cards': timeIt (scalar, len (deals))}
+
+def benchCalcProbabilities ():
+    results = {}
+    iterations = 1000
+    for boardCards in (0, 3, 4, 5):
+        hand, table = randomHands (1, [4, boardCards], 3) [0]
+        def scalar ():
+            Random.seed (4)
+            Evaluate.calcProbabilities (hand, table, 1, iterations)
+        results ['calcProbabilities.%d' % boardCards] = \
+            timeIt (scalar, iterations)
+        if Bot.BatchEvaluate.available ():
+            def batch ():
+                Random.seed (4)
+                Bot.BatchEvaluate.calcProbabilities (hand, table, 1,
+                    10 * iterations)
+            results ['calcProbabilities.batch.%d' % boardCards] = \
+                timeIt (batch, 10 * iterations)
+    return results
+
+def benchInitialize ():
+    results = {'initialize.evaluate': timeIt (Evaluate.generate, 1)}
+    if os.path.exists (Evaluate.TABLE_FILE):
+        results ['initialize.ranks'] = timeIt (Evaluate.load, 1)
+    if os.path.exists (LookupEvaluate.TABLE_FILE):
+        results ['initialize.lookup'] = timeIt (LookupEvaluate.load, 1)
+    return results
+
+def benchStartup ():
+    """ Seconds from starting the interpreter to a Bot ready for input """
+    command = [sys.executable, '-c',
+        'import Bot; Bot.Bot (None, Bot.EquityCache ())']
+    def run ():
+        subprocess.call (command, cwd = DIRECTORY)
+    return {'startup': timeIt (run, 1)}
+
+def benchBotRun ():
+    """ Seconds per decision of the transcript, through Bot.processLine """
+    lines = TRANSCRIPT.split ("\n")
+    actions = len ([l for l in lines if l.startswith ('Action')])
+    Bot.Bot.PONDER = False
+    def run ():
+        Random.seed (5)
+        B = Bot.Bot (Outbox (), EquityCache ())
+        for line in lines:
+            B.processLine (line)
+    return {'bot.decision': timeIt (run, actions)}
+
+BENCHMARKS = [
+    ('eval5', benchEval5),
+    ('eval9cards', benchEval9cards),
+    ('calcProbabilities', benchCalcProbabilities),
+    ('initialize', benchInitialize),
+    ('startup', benchStartup),
+    ('bot', benchBotRun)]
+
+def compare (results, baseline):
+    """ Prints the comparison, returns the names of the regressions """
+    regressions = []
+    for name in sorted (results):
+        line = "%-32s %12.3f us" % (name, results [name] * 1e6)
+        if name in baseline:
+            ratio = results [name] / baseline [name]['seconds']
+            threshold = baseline [name].get ('threshold', THRESHOLD)
+            line += "  x%.2f" % ratio
+            if ratio > threshold:
+                line += "  REGRESSION (> x%.2f)" % threshold
+                regressions.append (name)
+        print line
+    return regressions
+
+def main ():
+    args = [a for a in sys.argv [1:] if not a.startswith ('--')]
+    results = {}
+    for name, benchmark in BENCHMARKS:
+        if len (args) == 0 or [a for a in args if name.startswith (a)]:
+            results.update (benchmark ())
+
+    fp = open (OUTPUT_FILE, 'w')
+    json.dump (results, fp, indent = 1, sort_keys = True)
+    fp.close ()
+
+    if '--save-baseline' in sys.argv:
+        baseline = {}
+        if os.path.exists (BASELINE_FILE):
+            baseline = json.load (open (BASELINE_FILE))
+        for name in results:
+            threshold = baseline.get (name, {}).get ('threshold', THRESHOLD)
+            baseline [name] = {'seconds': results [name],
+                'threshold': threshold}
+        fp = open (BASELINE_FILE, 'w')
+        json.dump (baseline, fp, indent = 1, sort_keys = True)
+        fp.write ("\n")
+        fp.close ()
+        compare (results, {})
+        return 0
+
+    baseline = {}
+    if os.path.exists (BASELINE_FILE):
+        baseline = json.load (open (BASELINE_FILE))
+    if len (compare (results, baseline)) > 0:
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit (main ())
@@ -0,0 +1,54 @@
+#!/usr/bin/python
+"""
+Offline generation of the tables loaded by Bot.py.
+
+Usage: python gentables.py             rank tables (ranks.tbl) and eval5
+                                       tables (eval5.tbl)
+       python gentables.py --preflop [boards [rangedBoards]]
+                                       preflop equities (preflop.tbl),
+                                       needs numpy and eval5.tbl
+"""
+
+import sys
+import time
+
+from Bot import Evaluate, HandIndexer, LookupEvaluate, PreflopTable, Random
+
+
+def log (msg):
+    sys.stderr.write (msg + "\n")
+
+def main ():
+    start = time.time ()
+    if len (sys.argv) > 1 and sys.argv [1] == '--preflop':
+        boards = PreflopTable.BOARDS
+        rangedBoards = PreflopTable.RANGED_BOARDS
+        if len (sys.argv) > 2:
+            boards = int (sys.argv [2])
+        if len (sys.argv) > 3:
+            rangedBoards = int (sys.argv [3])
+        Random.seed (0)
+        PreflopTable.generate (boards, log)
+        PreflopTable.generateRanges (rangedBoards, log)
+        PreflopTable.save ()
+        print "preflop table: %d classes, %d boards, %d runouts per class, " \
+            "standard error %.3f%% (at most %.3f%%), %.1fs" % (
+            HandIndexer.get (0).size (), boards, PreflopTable.runouts,
+            PreflopTable.standardErrors [0] * 100.0 / PreflopTable.SCALE,
+            PreflopTable.standardErrors [1] * 100.0 / PreflopTable.SCALE,
+            time.time () - start)
+        print "ranged equities: %d buckets, %d boards, standard error " \
+            "%.3f%%" % (PreflopTable.BUCKETS, rangedBoards,
+            PreflopTable.rangeError * 100.0 / PreflopTable.SCALE)
+    else:
+        Evaluate.generate ()
+        Evaluate.save ()
+        print "rank tables: %d masks" % Evaluate.ARRAY_SIZE
+        LookupEvaluate.generate ()
+        LookupEvaluate.save ()
+        print "eval5 tables: %d signatures, %d buckets, %.1fs" % (
+            LookupEvaluate.tableSize, LookupEvaluate.noOfBuckets,
+            time.time () - start)
+
+if __name__ == '__main__':
+    main ()
@@ -0,0 +1,261 @@
+#!/usr/bin/python
+"""
+Headless self play: two Bot instances play heads up Omaha in process.
+
+The engine deals the hands, sends each bot the Settings / Match / Action
+lines of the theaigames protocol, reads the bots' answers from in memory
+streams and scores the showdowns with Evaluate.evalHand.  The deals come
+from their own seeded generator and the bots' simulations from the shared
+one, so a seed replays the same match as long as no deadline cuts a
+simulation (raise timePerMove to be sure).  When a bot is broke the stacks
+are reset and a new match starts.
+
+Usage: python selfplay.py [hands [seed [timePerMove [iterations]]]]
+
+iterations caps the Monte Carlo of every decision (Bot.MAX_ITERATIONS and
+Bot.BATCH_ITERATIONS), which is what bounds the number of hands per
+second.
+"""
+
+import sys
+import time
+
+from Bot import Bot, Deck, EquityCache, Evaluate, Hand, Random
+
+
+class Outbox (object):
+    """ The output stream of a bot, keeps what it writes """
+
+    def __init__ (self):
+        self._data = []
+
+    def write (self, s):
+        self._data.append (s)
+
+    def flush (self):
+        pass
+
+    def pop (self):
+        s = ''.join (self._data)
+        self._data = []
+        return s
+
+
+class Seat (object):
+    def __init__ (self, name):
+        self._name = name
+        self._out = Outbox ()
+        self._bot = Bot (self._out, EquityCache ())
+        self._stack = 0
+        self._bet = 0
+        self._hand = None
+        self._won = 0
+
+    def send (self, line):
+        self._bot.processLine (line)
+
+
+class SelfPlay (object):
+    STARTING_STACK = 2000
+    SMALL_BLIND = 10
+    BIG_BLIND = 20
+    HANDS_PER_LEVEL = 10
+    TIME_BANK = 5000
+
+    def __init__ (self, seed = 0, timePerMove = 500):
+        self._random = Random (seed)
+        Random.seed (seed)
+        self._timePerMove = timePerMove
+        self._seats = [Seat ('player1'), Seat ('player2')]
+        self._round = 0
+        self._matches = 0
+        self._showdowns = 0
+        for s in self._seats:
+            s.send ("Settings timeBank " + str (SelfPlay.TIME_BANK))
+            s.send ("Settings timePerMove " + str (timePerMove))
+            s.send ("Settings handsPerLevel " +
+                str (SelfPlay.HANDS_PER_LEVEL))
+            s.send ("Settings startingStack " +
+                str (SelfPlay.STARTING_STACK))
+            s.send ("Settings yourBot " + s._name)
+        self.newMatch ()
+
+    def newMatch (self):
+        self._matches += 1
+        for s in self._seats:
+            s._stack = SelfPlay.STARTING_STACK
+
+    def broadcast (self, line):
+        for s in self._seats:
+            s.send (line)
+
+    def pot (self):
+        return self._pot + sum ([s._bet for s in self._seats])
+
+    def post (self, seat, amount):
+        amount = min (amount, seat._stack)
+        seat._stack -= amount
+        seat._bet += amount
+        return amount
+
+    def ask (self, seat, other):
+        """ Sends the Action line to seat and returns its (move, amount) """
+        toCall = min (other._bet - seat._bet, seat._stack)
+        seat.send ("Match maxWinPot " + str (self.pot ()))
+        seat.send ("Match amountToCall " + str (toCall))
+        seat.send ("Action " + seat._name + " " + str (SelfPlay.TIME_BANK))
+        answer = seat._out.pop ().split ()
+        if len (answer) != 2:
+            return 'check', 0
+        return answer [0], int (answer [1])
+
+    def bettingRound (self, first):
+        """
+        Plays a street starting with seat index first, returns the seat
+        that folded or None
+        """
+        acted = [False, False]
+        p = first
+        while True:
+            seat = self._seats [p]
+            other = self._seats [1 - p]
+            toCall = other._bet - seat._bet
+            if (acted [p] and toCall <= 0) or \
+               (seat._stack == 0 and other._stack == 0):
+                return None
+            if seat._stack == 0:
+                # All in, only the other one decides
+                acted [p] = True
+                p = 1 - p
+                continue
+            if other._stack == 0 and toCall <= 0:
+                return None
+            move, amount = self.ask (seat, other)
+            if move == 'raise' and other._stack > 0:
+                # amount is what the bot puts in, the call included; the
+                # raise is at least a big blind and at most the pot
+                extra = amount - toCall
+                extra = max (extra, SelfPlay.BIG_BLIND)
+                extra = min (extra, self.pot () + toCall)
+                amount = self.post (seat, toCall + extra)
+                acted = [False, False]
+            elif move in ('call', 'raise') or \
+                    (move == 'check' and toCall == 0):
+                move = 'call' if toCall > 0 else 'check'
+                amount = self.post (seat, toCall)
+            else:
+                move = 'fold'
+                amount = 0
+            self.broadcast (seat._name + " " + move + " " + str (amount))
+            if move == 'fold':
+                return seat
+            acted [p] = True
+            p = 1 - p
+
+    def collect (self):
+        # What the other one could not match goes back
+        low = min ([s._bet for s in self._seats])
+        for s in self._seats:
+            s._stack += s._bet - low
+            s._bet = low
+        for s in self._seats:
+            self._pot += s._bet
+            s._bet = 0
+
+    def award (self, winners):
+        share = self._pot / len (winners)
+        odd = self._pot - share * len (winners)
+        for n, s in enumerate (winners):
+            amount = share + (odd if n == 0 else 0)
+            s._stack += amount
+            self.broadcast (s._name + " wins " + str (amount))
+        self._pot = 0
+
+    def playHand (self):
+        self._round += 1
+        button = self._round % 2
+        seats = self._seats
+        startStacks = [s._stack for s in seats]
+        self._pot = 0
+
+        deck = Deck (0, self._random)
+        deck.shuffle (13)
+        for s in seats:
+            s._hand = Hand ()
+            for i in range (0, 4):
+                s._hand.addCard (deck.deal ())
+        board = Hand ()
+
+        self.broadcast ("Match round " + str (self._round))
+        self.broadcast ("Match smallBlind " + str (SelfPlay.SMALL_BLIND))
+        self.broadcast ("Match bigBlind " + str (SelfPlay.BIG_BLIND))
+        self.broadcast ("Match onButton " + seats [button]._name)
+        for s in seats:
+            self.broadcast (s._name + " stack " + str (s._stack))
+        sb = self.post (seats [button], SelfPlay.SMALL_BLIND)
+        self.broadcast (seats [button]._name + " post " + str (sb))
+        bb = self.post (seats [1 - button], SelfPlay.BIG_BLIND)
+        self.broadcast (seats [1 - button]._name + " post " + str (bb))
+        for s in seats:
+            s.send (s._name + " hand " + s._hand.getCardCode ())
+
+        # The button acts first preflop and last after
+        folded = self.bettingRound (button)
+        for cards in (3, 1, 1):
+            if folded != None:
+                break
+            self.collect ()
+            for i in range (0, cards):
+                board.addCard (deck.deal ())
+            self.broadcast ("Match table " + board.getCardCode ())
+            folded = self.bettingRound (1 - button)
+        self.collect ()
+
+        if folded != None:
+            self.award ([seats [1 - seats.index (folded)]])
+        else:
+            self._showdowns += 1
+            scores = [Evaluate.evalHand (s._hand, board) for s in seats]
+            best = max (scores)
+            # The odd chip goes to the first winner after the button
+            self.award ([seats [(1 - button + n) % 2] for n in range (0, 2)
+                if scores [(1 - button + n) % 2] == best])
+
+        for n, s in enumerate (seats):
+            s._won += s._stack - startStacks [n]
+        if min ([s._stack for s in seats]) == 0:
+            self.newMatch ()
+
+    def play (self, hands):
+        for i in range (0, hands):
+            self.playHand ()
+
+
+def main ():
+    hands = 1000
+    seed = 0
+    timePerMove = 500
+    if len (sys.argv) > 1:
+        hands = int (sys.argv [1])
+    if len (sys.argv) > 2:
+        seed = int (sys.argv [2])
+    if len (sys.argv) > 3:
+        timePerMove = int (sys.argv [3])
+    if len (sys.argv) > 4:
+        Bot.MAX_ITERATIONS = int (sys.argv [4])
+        Bot.BATCH_ITERATIONS = int (sys.argv [4])
+    # Pondering runs in threads, which would make the runs depend on timing
+    Bot.PONDER = False
+
+    S = SelfPlay (seed, timePerMove)
+    start = time.time ()
+    S.play (hands)
+    elapsed = time.time () - start
+    print "hands %d matches %d showdowns %d seconds %.2f hands/s %.1f" % (
+        hands, S._matches, S._showdowns, elapsed, hands / elapsed)
+    for s in S._seats:
+        print "%s won %d chips, %.1f bb/100" % (s._name, s._won,
+            s._won * 100.0 / SelfPlay.BIG_BLIND / hands)
+
+if __name__ == '__main__':
+    main ()